@@ -7,10 +7,11 @@ import subprocess
 import threading
 import time
 import urllib.error
+import urllib.parse
 import urllib.request
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 from AppHandler import (
     current_logical_service,
@@ -30,7 +31,7 @@ from jsonconfig import (
 )
 from logger import get_agent_logger
 from ui import EstandardUse, LoadingUI, ErrorUI, ErrorUIBlink, UIOFF, SyncingUI, UIShutdownProceess
-from . import hardware
+from . import frames, hardware
 
 
 class AgentRuntime:
@@ -44,10 +45,15 @@ class AgentRuntime:
     STRUCTURE_PATH = Path(__file__).resolve().parents[1] / "agent_pi" / "data" / "structure.json"
     SERVER_INFO_PATH = Path(__file__).resolve().parents[1] / "agent_pi" / "data" / "server.json"
     SERVER_HTTP_PORT_DEFAULT = 8000
+    # How often a synced MIDI preset is checked for still being on the server.
+    MIDI_SYNC_CHECK_S = 60.0
 
     def __init__(self) -> None:
         self.logger = get_agent_logger()
         self.server_api_base: Optional[str] = None
+        self.server_info: Optional[Dict[str, str]] = None
+        self.midi_synced: Optional[Tuple[str, int]] = None
+        self.midi_checked_at = 0.0
 
         self.snapshot_lock = threading.Lock()
         self.config_lock = threading.Lock()
@@ -101,6 +107,14 @@ class AgentRuntime:
         payload.update(extra)
         return payload
 
+    def _encode_ack(self, command: Dict[str, Any], ack: Dict[str, Any], **fields: Any) -> bytes:
+        """Use the binary frame when the server advertised support for it and the ACK fits."""
+        if command.get("binary_ack") and ack.get("ok"):
+            frame = frames.pack_ack(ack["type"], ack.get("request_id"), True, ack.get("serial"), **fields)
+            if frame is not None:
+                return frame
+        return json.dumps(ack).encode("utf-8")
+
     # ------------------------------------------------------------------
     # Public lifecycle
     # ------------------------------------------------------------------
@@ -147,19 +161,24 @@ class AgentRuntime:
         self.logger.info("Escuchando broadcast en :%s", self.BCAST_PORT)
 
         s_reply = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        buf = bytearray(4096)
+        view = memoryview(buf)
 
         try:
             while True:
                 try:
-                    data, addr = s_listen.recvfrom(4096)
+                    size, addr = s_listen.recvfrom_into(buf)
                 except socket.timeout:
                     continue
 
                 try:
-                    payload = json.loads(data.decode("utf-8", "ignore"))
+                    payload = json.loads(str(view[:size], "utf-8", "ignore"))
                 except Exception as exc:
                     self.logger.warning("Mensaje inválido desde %s: %s", addr[0], exc)
                     continue
+                if not isinstance(payload, dict):
+                    self.logger.warning("Mensaje inválido desde %s: no es un objeto JSON", addr[0])
+                    continue
 
                 msg_type = payload.get("type")
 
@@ -171,7 +190,11 @@ class AgentRuntime:
                     reply = self._build_status_payload(snap)
                     try:
                         s_reply.sendto(json.dumps(reply).encode("utf-8"), (server_ip, reply_port))
-                        self.logger.info("Estado enviado a %s:%s", server_ip, reply_port)
+                        # Only the first reply after (re)connecting is worth an INFO line.
+                        if self._server_is_online():
+                            self.logger.debug("Estado enviado a %s:%s", server_ip, reply_port)
+                        else:
+                            self.logger.info("Estado enviado a %s:%s", server_ip, reply_port)
                         self._mark_server_seen()
                     except Exception as exc:
                         self.logger.error("Error enviando estado al servidor: %s", exc)
@@ -236,16 +259,19 @@ class AgentRuntime:
             "serial": identity.get("serial", ""),
             "host": identity.get("host", ""),
         }
-        set_runtime_env(
-            {
-                "OMI_SERVER_API": info["api"],
-                "OMI_AGENT_SERIAL": info["serial"],
-                "OMI_AGENT_HOST": info["host"],
-            }
-        )
-        self._write_server_info(info)
+        # DISCOVER arrives every few seconds; only act when something actually changed.
+        if info != self.server_info:
+            set_runtime_env(
+                {
+                    "OMI_SERVER_API": info["api"],
+                    "OMI_AGENT_SERIAL": info["serial"],
+                    "OMI_AGENT_HOST": info["host"],
+                }
+            )
+            self._write_server_info(info)
+            self.server_info = info
+            self.logger.info("Servidor API detectado en %s", self.server_api_base)
         self._upload_midi_config_to_server()
-        self.logger.info("Servidor API detectado en %s", self.server_api_base)
 
     def _write_server_info(self, info: Dict[str, Any]) -> None:
         try:
@@ -306,9 +332,22 @@ class AgentRuntime:
     def _upload_midi_config_to_server(self) -> None:
         if not self.server_api_base:
             return
+        try:
+            stamp = (self.server_api_base, self._midi_map_path().stat().st_mtime_ns)
+        except OSError:
+            return
+        synced = stamp == self.midi_synced
+        if synced and time.monotonic() - self.midi_checked_at < self.MIDI_SYNC_CHECK_S:
+            return
         data = self._read_midi_config()
         if not data:
             return
+        if synced:
+            # A wiped or restored server DB keeps the same address; re-send the preset if it is gone.
+            self.midi_checked_at = time.monotonic()
+            if self._server_has_midi_config(data.get("config_name", "default")) is not False:
+                return
+            self.midi_synced = None
         info = {
             "name": data.get("config_name", "default"),
             "data": data,
@@ -326,10 +365,25 @@ class AgentRuntime:
                 method="POST",
             )
             urllib.request.urlopen(req, timeout=5)
+            self.midi_synced = stamp
+            self.midi_checked_at = time.monotonic()
             self.logger.info("Preset MIDI sincronizado con el servidor")
         except Exception as exc:
             self.logger.warning("No se pudo sincronizar preset local con servidor: %s", exc)
 
+    def _server_has_midi_config(self, config_name: str) -> Optional[bool]:
+        """Whether the server still stores ``config_name`` with data; ``None`` if it could not be asked."""
+        url = f"{self.server_api_base}/api/configs/MIDI/{urllib.parse.quote(config_name, safe='')}"
+        req = urllib.request.Request(url, headers={"Accept": "application/json"})
+        try:
+            with urllib.request.urlopen(req, timeout=5) as resp:
+                payload = json.load(resp)
+        except urllib.error.HTTPError as exc:
+            return False if exc.code == 404 else None
+        except Exception:
+            return None
+        return bool(isinstance(payload, dict) and payload.get("data"))
+
     def _download_service_config(self, service: str, config_name: str) -> None:
         if not self.server_api_base:
             raise RuntimeError("sin servidor API disponible")
@@ -340,6 +394,9 @@ class AgentRuntime:
                 payload = json.load(resp)
         except urllib.error.HTTPError as exc:
             if exc.code == 404:
+                if service == "MIDI":
+                    # The server lost the preset; let the next DISCOVER upload the local one.
+                    self.midi_synced = None
                 self.logger.warning("Preset %s/%s no existe en servidor, se mantiene configuración local", service, config_name)
                 return
             raise RuntimeError(f"configuración '{config_name}' no disponible ({exc.code})") from exc
@@ -685,7 +742,7 @@ class AgentRuntime:
             self.logger.error("Error procesando comando de energía '%s': %s", action, exc)
 
         try:
-            s_reply.sendto(json.dumps(ack).encode("utf-8"), (reply_ip, reply_port))
+            s_reply.sendto(self._encode_ack(payload, ack, action=action), (reply_ip, reply_port))
         except Exception as exc:
             self.logger.error("Error enviando POWER_ACK al servidor: %s", exc)
 
@@ -717,7 +774,7 @@ class AgentRuntime:
             self.logger.error("No se pudo actualizar índice: %s", exc)
 
         try:
-            s_reply.sendto(json.dumps(ack).encode("utf-8"), (reply_ip, reply_port))
+            s_reply.sendto(self._encode_ack(payload, ack, index=ack.get("index")), (reply_ip, reply_port))
         except Exception as exc:
             self.logger.error("Error enviando INDEX_ACK al servidor: %s", exc)
 
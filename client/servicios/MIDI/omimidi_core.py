@@ -3,7 +3,8 @@ from __future__ import annotations
 import os, json, time, threading, socket, ipaddress, sys, signal, tempfile, atexit
 import urllib.error
 import urllib.request
-from typing import Any, Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
 from datetime import datetime, timezone
 import urllib.request
 from pathlib import Path
@@ -184,22 +185,47 @@ def build_osc_clients_from_map(map_obj: MidiMap) -> List[BroadcastUDPClient]:
     return clients
 
 # ---- Notificación WebUI (push de valores) ----
+# Solo importa el último valor de cada ruta: los eventos se guardan por ruta
+# (uno nuevo reemplaza al pendiente) y un único worker los va enviando.
+_WEBUI_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="omimidi-webui")
+_WEBUI_LOCK = threading.Lock()
+_WEBUI_LATEST: Dict[str, Tuple[bytes, int]] = {}
+_WEBUI_SCHEDULED = False
+
+
 def _notify_webui_async(route_idx: int, path: str, value: Any, route_meta: Dict[str, Any], ui_port: int):
     """POST no bloqueante a la WebUI para empujar estados a los clientes."""
-    def _post():
+    global _WEBUI_SCHEDULED
+    payload = json.dumps({
+        "route_idx": route_idx,
+        "path": path,
+        "value": value,
+        "route": {
+            "type": route_meta.get("type"),
+            "note": route_meta.get("note"),
+            "cc": route_meta.get("cc"),
+            "channel": route_meta.get("channel"),
+        },
+        "ts": datetime.now(timezone.utc).isoformat()
+    }).encode("utf-8")
+    with _WEBUI_LOCK:
+        _WEBUI_LATEST[path] = (payload, ui_port)
+        if _WEBUI_SCHEDULED:
+            return
+        _WEBUI_SCHEDULED = True
+    _WEBUI_EXECUTOR.submit(_drain_webui)
+
+
+def _drain_webui() -> None:
+    global _WEBUI_SCHEDULED
+    while True:
+        with _WEBUI_LOCK:
+            if not _WEBUI_LATEST:
+                _WEBUI_SCHEDULED = False
+                return
+            path = next(iter(_WEBUI_LATEST))
+            payload, ui_port = _WEBUI_LATEST.pop(path)
         try:
-            payload = json.dumps({
-                "route_idx": route_idx,
-                "path": path,
-                "value": value,
-                "route": {
-                    "type": route_meta.get("type"),
-                    "note": route_meta.get("note"),
-                    "cc": route_meta.get("cc"),
-                    "channel": route_meta.get("channel"),
-                },
-                "ts": datetime.now(timezone.utc).isoformat()
-            }).encode("utf-8")
             req = urllib.request.Request(
                 url=f"http://127.0.0.1:{ui_port}/push_state",
                 data=payload,
@@ -210,7 +236,6 @@ def _notify_webui_async(route_idx: int, path: str, value: Any, route_meta: Dict[
         except Exception as exc:
             # Si no hay WebUI escuchando, seguimos sin bloquear pero lo registramos.
             LOGGER.debug("No se pudo notificar estado a la WebUI (%s): %s", path, exc)
-    threading.Thread(target=_post, daemon=True).start()
 
 # ---- Core ----
 class OmiMidiCore:
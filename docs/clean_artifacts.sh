@@ -30,6 +30,8 @@ remove_path() {
 
 # Artefactos de servidor
 remove_path "$REPO_ROOT/server/omi.db"
+remove_path "$REPO_ROOT/server/omi.db-wal"
+remove_path "$REPO_ROOT/server/omi.db-shm"
 remove_path "$REPO_ROOT/server/logs"
 
 # Artefactos del agente / cliente
@@ -16,6 +16,13 @@ if exist "server\omi.db" (
 ) else (
   echo [ clean ] No existe server\omi.db (ok)
 )
+for %%F in (omi.db-wal omi.db-shm) do (
+  if exist "server\%%F" (
+    del /q /f "server\%%F" && echo [ clean ] Eliminado server\%%F
+  ) else (
+    echo [ clean ] No existe server\%%F ^(ok^)
+  )
+)
 if exist "server\logs" (
   rmdir /s /q "server\logs" && echo [ clean ] Eliminado server\logs
 ) else (
@@ -6,12 +6,14 @@ from typing import Dict
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 
-from ..db import init_db
+from ..db import close_db, init_db
 from .broadcast import BroadcastManager
 from .registry import DeviceRegistry
 from .routes import router
 from .settings import Settings
 from .network import NetworkManager
+from .push import UiHub
+from .web import BodySizeLimit, CodecJSONResponse
 
 LOGGER = logging.getLogger("omi.server.app")
 
@@ -21,25 +23,30 @@ def create_app() -> FastAPI:
     registry = DeviceRegistry(settings.status_ttl)
     manager = BroadcastManager(settings, registry)
     network = NetworkManager()
+    hub = UiHub(registry)
 
     init_db()
 
-    app = FastAPI(title="OMI Control Server", version="0.2")
-    app.state.context = _build_context(settings, registry, manager, network)
+    app = FastAPI(title="OMI Control Server", version="0.2", default_response_class=CodecJSONResponse)
+    app.state.context = _build_context(settings, registry, manager, network, hub)
 
     if settings.static_root.exists():
         app.mount("/static", StaticFiles(directory=settings.static_root), name="static")
 
     app.include_router(router)
+    app.add_middleware(BodySizeLimit)
 
     @app.on_event("startup")
     async def _startup() -> None:
         manager.start()
+        hub.start()
         LOGGER.info("Broadcast manager iniciado")
 
     @app.on_event("shutdown")
     async def _shutdown() -> None:
+        await hub.stop()
         manager.stop()
+        close_db()
         LOGGER.info("Broadcast manager detenido")
 
     return app
@@ -50,10 +57,12 @@ def _build_context(
     registry: DeviceRegistry,
     manager: BroadcastManager,
     network: NetworkManager,
+    hub: UiHub,
 ) -> Dict[str, object]:
     return {
         "settings": settings,
         "registry": registry,
         "manager": manager,
         "network": network,
+        "hub": hub,
     }
@@ -1,64 +1,155 @@
 from __future__ import annotations
 
-import json
+import asyncio
 import logging
+import os
+import queue
 import socket
 import threading
 import time
-import uuid
 from contextlib import contextmanager
-from typing import Any, Dict, Optional
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
 
-from .. import db
+from .. import db, jsoncodec
+from . import frames, udp
 from .registry import DeviceRegistry
 from .settings import Settings
 from .errors import api_error
 
 LOGGER = logging.getLogger("omi.server.broadcast")
 
+MAX_DATAGRAM = 16_384
+PENDING_MAX = 10_000
+PENDING_MAX_AGE_S = 60.0
+# A lost SET_INDEX blocks re-sending to that agent until its slot expires.
+INDEX_PENDING_MAX_AGE_S = 10.0
+REAPER_INTERVAL_S = 5.0
+LOCAL_IP_REFRESH_S = 300.0
+# Every agent answers a DISCOVER at once; room for that burst avoids kernel drops.
+# Linux caps the request at net.core.rmem_max.
+LISTEN_RCVBUF = 1 << 20
+# Datagrams waiting for the dispatch thread; beyond this they are dropped.
+RX_QUEUE_MAX = 4096
+
+# SET_INDEX only varies in three integers, so it is formatted straight to bytes.
+# The agent ships without the server, so it carries its own copy of frames.py.
+_AGENT_FRAMES = Path(__file__).resolve().parents[2] / "client" / "agent" / "frames.py"
+_SET_INDEX_TEMPLATE = b'{"type":"SET_INDEX","index":%d,"request_id":"%016x","reply_port":%d,"binary_ack":true}'
+
+
+def _check_frames_copy() -> None:
+    """Warn when the agent's frames.py no longer matches the server's."""
+    try:
+        agent_copy = _AGENT_FRAMES.read_bytes()
+    except OSError:
+        # Server deployed without the client tree; nothing to compare against.
+        return
+    if agent_copy != Path(frames.__file__).read_bytes():
+        LOGGER.warning("client/agent/frames.py difiere de server/app/frames.py; las tramas binarias pueden no entenderse")
+
+
+def _new_request_id() -> int:
+    return int.from_bytes(os.urandom(8), "big")
+
+
+def _parse_request_id(raw: Any) -> Optional[int]:
+    """Request ids travel as 16 hex digits but are keyed as ints internally."""
+    if not isinstance(raw, str):
+        return None
+    try:
+        return int(raw, 16)
+    except ValueError:
+        return None
+
 
 class PendingRequest:
-    def __init__(self) -> None:
-        self.event = threading.Event()
+    """Reply slot filled by the listener thread.
+
+    When created with an event loop the reply is handed to ``future`` through
+    ``call_soon_threadsafe`` so coroutines can ``await wait_async``. Slots
+    without a loop (bulk SET_INDEX) are fire-and-forget and only keep the payload.
+    """
+
+    def __init__(self, serial: Optional[str] = None, loop: Optional[asyncio.AbstractEventLoop] = None) -> None:
         self.payload: Optional[Dict] = None
+        self.serial = serial
+        self.created_at = time.monotonic()
+        self.loop = loop
+        self.future: Optional[asyncio.Future] = loop.create_future() if loop is not None else None
 
     def update(self, payload: Dict) -> None:
         self.payload = payload
 
     def set(self, payload: Dict) -> None:
         self.payload = payload
-        self.event.set()
+        if self.future is not None:
+            try:
+                self.loop.call_soon_threadsafe(self._resolve)
+            except RuntimeError:
+                # Loop already closed (shutdown); nobody is awaiting anymore.
+                pass
 
-    def wait(self, timeout: float) -> Dict:
-        if not self.event.wait(timeout):
-            raise TimeoutError
-        return self.payload or {}
+    def _resolve(self) -> None:
+        if not self.future.done():
+            self.future.set_result(self.payload or {})
+
+    async def wait_async(self, timeout: float) -> Dict:
+        try:
+            return await asyncio.wait_for(self.future, timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError from None
 
 
 class BroadcastManager:
     def __init__(self, settings: Settings, registry: DeviceRegistry) -> None:
         self.settings = settings
         self.registry = registry
+        self._load_settings()
         self.stop_evt = threading.Event()
         self.broadcast_thread: Optional[threading.Thread] = None
         self.listen_thread: Optional[threading.Thread] = None
+        self.dispatch_thread: Optional[threading.Thread] = None
+        self._rxq: "queue.Queue[Tuple[bytes, Any]]" = queue.Queue(RX_QUEUE_MAX)
+        self.reaper_thread: Optional[threading.Thread] = None
         self.command_socket: Optional[socket.socket] = None
-        self.pending: Dict[str, PendingRequest] = {}
+        # Single-key reads, pops and discards on ``pending``/``pending_index`` are
+        # atomic under the GIL and are done without a lock; whoever pops an entry
+        # owns it. ``pending_lock`` only serialises registration, where the size
+        # check and insert must happen together. Iteration goes over a ``list()``
+        # snapshot. A free-threaded build would need a lock around every access.
+        self.pending: Dict[int, PendingRequest] = {}
         self.pending_lock = threading.Lock()
         self.pending_index: set[str] = set()
 
+    def _load_settings(self) -> None:
+        """Snapshot the settings used on hot paths into plain attributes."""
+        self._reply_port = int(self.settings.reply_port)
+        self._http_port = int(self.settings.http_port)
+        self._command_port = int(self.settings.broadcast_port)
+        self._bcast_addr = (self.settings.broadcast_ip, self._command_port)
+        self._discover_interval = float(self.settings.discover_interval)
+        self._status_ttl = float(self.settings.status_ttl)
+
     def start(self) -> None:
         if self.broadcast_thread and self.broadcast_thread.is_alive():
             return
         self.stop_evt.clear()
+        self._load_settings()
+        _check_frames_copy()
         self.command_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.command_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.command_socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
         self.command_socket.bind(("", 0))
 
         self.broadcast_thread = threading.Thread(target=self._broadcast_loop, name="omi-broadcast", daemon=True)
         self.listen_thread = threading.Thread(target=self._listen_loop, name="omi-listen", daemon=True)
+        self.dispatch_thread = threading.Thread(target=self._dispatch_loop, name="omi-dispatch", daemon=True)
+        self.reaper_thread = threading.Thread(target=self._reaper_loop, name="omi-pending-reaper", daemon=True)
         self.broadcast_thread.start()
         self.listen_thread.start()
+        self.dispatch_thread.start()
+        self.reaper_thread.start()
 
     def stop(self) -> None:
         self.stop_evt.set()
@@ -66,132 +157,229 @@ class BroadcastManager:
             self.broadcast_thread.join(timeout=1.5)
         if self.listen_thread:
             self.listen_thread.join(timeout=1.5)
+        if self.dispatch_thread:
+            self.dispatch_thread.join(timeout=1.5)
+        if self.reaper_thread:
+            self.reaper_thread.join(timeout=1.5)
         if self.command_socket:
             try:
                 self.command_socket.close()
             except Exception:
                 pass
-        with self.pending_lock:
-            for pending in self.pending.values():
-                pending.set({"ok": False, "error": "shutdown"})
-            self.pending.clear()
-            self.pending_index.clear()
+        pending_requests = list(self.pending.values())
+        self.pending.clear()
+        self.pending_index.clear()
+        for pending in pending_requests:
+            pending.set({"ok": False, "error": "shutdown"})
 
     def _broadcast_loop(self) -> None:
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-        try:
-            while not self.stop_evt.is_set():
-                payload = {
-                    "type": "DISCOVER",
-                    "server_ip": self._local_ip(),
-                    "reply_port": self.settings.reply_port,
-                    "http_port": self.settings.http_port,
-                    "ts": time.time(),
-                }
-                try:
-                    s.sendto(json.dumps(payload).encode("utf-8"), (self.settings.broadcast_ip, self.settings.broadcast_port))
-                    LOGGER.debug("Broadcast DISCOVER → %s:%s", self.settings.broadcast_ip, self.settings.broadcast_port)
-                except Exception as exc:
-                    LOGGER.error("Error enviando broadcast: %s", exc)
-                for _ in range(int(self.settings.discover_interval * 10)):
-                    if self.stop_evt.is_set():
-                        break
-                    time.sleep(0.1)
-        finally:
-            s.close()
+        # DISCOVER goes out on the command socket; agents reply to reply_port, not the source port.
+        s = self.command_socket
+        server_ip: Optional[str] = None
+        resolved_at = 0.0
+        next_tick = time.monotonic()
+        while not self.stop_evt.is_set():
+            # Re-resolve periodically, after a send error, or while we only know loopback.
+            if server_ip is None or time.monotonic() - resolved_at > LOCAL_IP_REFRESH_S:
+                server_ip = self._local_ip()
+                resolved_at = time.monotonic()
+                prefix = self._discover_prefix(server_ip)
+                if server_ip == "127.0.0.1":
+                    server_ip = None
+            try:
+                s.sendto(prefix + repr(time.time()).encode("ascii") + b"}", self._bcast_addr)
+                LOGGER.debug("Broadcast DISCOVER → %s:%s", *self._bcast_addr)
+            except Exception as exc:
+                LOGGER.error("Error enviando broadcast: %s", exc)
+                server_ip = None
+            # Fixed cadence on the monotonic clock; after a stall, resume instead of bursting.
+            now = time.monotonic()
+            next_tick = max(next_tick + self._discover_interval, now)
+            if self.stop_evt.wait(next_tick - now):
+                break
+
+    def _discover_prefix(self, server_ip: str) -> bytes:
+        """DISCOVER encoded up to its ``ts`` value, the only field that changes per tick."""
+        body = jsoncodec.dumps(
+            {
+                "type": "DISCOVER",
+                "server_ip": server_ip,
+                "reply_port": self._reply_port,
+                "http_port": self._http_port,
+            }
+        )
+        return body[:-1] + b',"ts":'
+
+    def _reaper_loop(self) -> None:
+        while not self.stop_evt.wait(REAPER_INTERVAL_S):
+            self._reap_pending()
+
+    def _reap_pending(self) -> None:
+        """Expire pending requests whose agent never answered (e.g. it crashed)."""
+        now = time.monotonic()
+        expired = 0
+        for req_id, pending in list(self.pending.items()):
+            max_age = INDEX_PENDING_MAX_AGE_S if pending.serial else PENDING_MAX_AGE_S
+            if pending.created_at < now - max_age and self.pending.pop(req_id, None) is pending:
+                pending.set({"ok": False, "error": "expired"})
+                if pending.serial:
+                    self.pending_index.discard(pending.serial)
+                expired += 1
+        if expired:
+            LOGGER.warning("%d solicitudes pendientes expiradas sin respuesta", expired)
+
+    def _register_pending(
+        self,
+        request_id: int,
+        serial: str,
+        *,
+        track_index: bool = False,
+        loop: Optional[asyncio.AbstractEventLoop] = None,
+    ) -> PendingRequest:
+        pending = PendingRequest(serial if track_index else None, loop)
+        with self.pending_lock:
+            if len(self.pending) >= PENDING_MAX:
+                api_error(
+                    503,
+                    "demasiadas solicitudes pendientes",
+                    logger=LOGGER,
+                    context={"serial": serial, "pending": PENDING_MAX},
+                )
+            self.pending[request_id] = pending
+            if track_index:
+                self.pending_index.add(serial)
+        return pending
 
     def _listen_loop(self) -> None:
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        s.bind(("", self.settings.reply_port))
+        try:
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, LISTEN_RCVBUF)
+        except OSError as exc:
+            LOGGER.warning("No se pudo ampliar el búfer de recepción UDP: %s", exc)
+        s.bind(("", self._reply_port))
         s.settimeout(0.5)
+        # One receive buffer for the whole loop; each datagram is copied out and
+        # handed to the dispatch thread, so a slow DB write never stalls the socket.
+        rxbuf = bytearray(MAX_DATAGRAM + 1)
+        rxview = memoryview(rxbuf)
         try:
             while not self.stop_evt.is_set():
                 try:
-                    data, addr = s.recvfrom(4096)
+                    size, addr = s.recvfrom_into(rxbuf)
                 except socket.timeout:
                     continue
                 except Exception as exc:
                     LOGGER.error("Error de socket en listener: %s", exc)
                     continue
 
-                try:
-                    payload = json.loads(data.decode("utf-8", "ignore"))
-                except Exception:
-                    LOGGER.warning("JSON inválido recibido: %r", data)
+                data = rxview[:size]
+                if size > MAX_DATAGRAM:
+                    LOGGER.warning("Datagrama de %s descartado: supera %d bytes", addr[0], MAX_DATAGRAM)
                     continue
 
-                msg_type = payload.get("type")
-
-                if msg_type == "AGENT_STATUS":
-                    assigned_index, reported_index = self.registry.update_from_status(payload, addr)
-                    serial = payload.get("serial") or addr[0]
-                    LOGGER.info("Estado recibido de %s", serial)
-                    if assigned_index is not None and payload.get("serial") and assigned_index != reported_index:
-                        try:
-                            self.request_index_update(payload["serial"], assigned_index)
-                        except Exception as exc:
-                            LOGGER.error("No se pudo actualizar índice de %s: %s", payload["serial"], exc)
-
-                elif msg_type == "SERVICE_ACK":
-                    self._handle_service_ack(payload)
-
-                elif msg_type == "POWER_ACK":
-                    request_id = payload.get("request_id")
-                    if request_id:
-                        with self.pending_lock:
-                            pending = self.pending.pop(request_id, None)
-                        if pending:
-                            pending.set(payload)
-                    serial = payload.get("serial")
-                    if serial:
-                        LOGGER.info(
-                            "ACK de energía (%s) recibido de %s (ok=%s)",
-                            payload.get("action"),
-                            serial,
-                            payload.get("ok"),
-                        )
-
-                elif msg_type == "INDEX_ACK":
-                    request_id = payload.get("request_id")
-                    if request_id:
-                        with self.pending_lock:
-                            pending = self.pending.pop(request_id, None)
-                        if pending:
-                            pending.set(payload)
-                    serial = payload.get("serial")
-                    if serial:
-                        with self.pending_lock:
-                            self.pending_index.discard(serial)
-                        self.registry.update_index(serial, payload.get("index"))
-                        LOGGER.info(
-                            "ACK de índice recibido de %s (index=%s, ok=%s)",
-                            serial,
-                            payload.get("index"),
-                            payload.get("ok"),
-                        )
-                else:
-                    LOGGER.debug("Mensaje desconocido de %s: %s", addr[0], payload)
+                try:
+                    self._rxq.put_nowait((bytes(data), addr))
+                except queue.Full:
+                    LOGGER.warning("Cola de recepción llena; datagrama de %s descartado", addr[0])
         finally:
             s.close()
 
+    def _dispatch_loop(self) -> None:
+        while not self.stop_evt.is_set():
+            try:
+                data, addr = self._rxq.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                self._handle_datagram(data, addr)
+            except Exception:
+                LOGGER.exception("Error procesando mensaje de %s", addr[0])
+
+    def _handle_datagram(self, data: bytes, addr) -> None:
+        if frames.is_frame(data):
+            payload = frames.unpack_ack(data)
+            if payload is None:
+                LOGGER.warning("Trama binaria inválida recibida: %r", data)
+                return
+        else:
+            try:
+                payload = jsoncodec.loads(data)
+            except Exception:
+                LOGGER.warning("JSON inválido recibido: %r", data)
+                return
+            if not isinstance(payload, dict):
+                LOGGER.warning("Mensaje JSON inesperado de %s: %r", addr[0], payload)
+                return
+
+        msg_type = payload.get("type")
+
+        if msg_type == "AGENT_STATUS":
+            previous = self.registry.get_device(payload.get("serial") or "")
+            assigned_index, reported_index = self.registry.update_from_status(payload, addr)
+            serial = payload.get("serial") or addr[0]
+            # Heartbeats arrive every DISCOVER interval; only (re)appearances go to INFO.
+            if previous is None or time.time() - previous.get("last_seen", 0.0) >= self._status_ttl:
+                LOGGER.info("Estado recibido de %s", serial)
+            else:
+                LOGGER.debug("Estado recibido de %s", serial)
+            if assigned_index is not None and payload.get("serial") and assigned_index != reported_index:
+                try:
+                    self.request_index_update_bulk([(payload["serial"], assigned_index)])
+                except Exception as exc:
+                    LOGGER.error("No se pudo actualizar índice de %s: %s", payload["serial"], exc)
+
+        elif msg_type == "SERVICE_ACK":
+            self._handle_service_ack(payload)
+
+        elif msg_type == "POWER_ACK":
+            request_id = _parse_request_id(payload.get("request_id"))
+            if request_id is not None:
+                pending = self.pending.pop(request_id, None)
+                if pending:
+                    pending.set(payload)
+            serial = payload.get("serial")
+            if serial:
+                LOGGER.info(
+                    "ACK de energía (%s) recibido de %s (ok=%s)",
+                    payload.get("action"),
+                    serial,
+                    payload.get("ok"),
+                )
+
+        elif msg_type == "INDEX_ACK":
+            request_id = _parse_request_id(payload.get("request_id"))
+            if request_id is not None:
+                pending = self.pending.pop(request_id, None)
+                if pending:
+                    pending.set(payload)
+            serial = payload.get("serial")
+            if serial:
+                self.pending_index.discard(serial)
+                self.registry.update_index(serial, payload.get("index"))
+                LOGGER.info(
+                    "ACK de índice recibido de %s (index=%s, ok=%s)",
+                    serial,
+                    payload.get("index"),
+                    payload.get("ok"),
+                )
+        else:
+            LOGGER.debug("Mensaje desconocido de %s: %s", addr[0], payload)
+
     def _handle_service_ack(self, payload: Dict) -> None:
-        request_id = payload.get("request_id")
+        request_id = _parse_request_id(payload.get("request_id"))
         transition = bool(payload.get("transition"))
         serial = payload.get("serial")
         stage = payload.get("stage")
         ok_flag = payload.get("ok")
         progress = payload.get("progress")
-        if request_id:
+        if request_id is not None:
             if transition:
-                with self.pending_lock:
-                    pending = self.pending.get(request_id)
+                pending = self.pending.get(request_id)
                 if pending:
                     pending.update(payload)
             else:
-                with self.pending_lock:
-                    pending = self.pending.pop(request_id, None)
+                pending = self.pending.pop(request_id, None)
                 if pending:
                     pending.set(payload)
         if serial:
@@ -221,7 +409,7 @@ class BroadcastManager:
         finally:
             s.close()
 
-    def request_service_change(self, serial: str, service: str, *, config: Optional[str] = None, timeout: float = 25.0) -> Dict[str, Any]:
+    async def request_service_change(self, serial: str, service: str, *, config: Optional[str] = None, timeout: float = 25.0) -> Dict[str, Any]:
         device = self.registry.get_device(serial)
         if not device:
             api_error(
@@ -238,27 +426,24 @@ class BroadcastManager:
                 context={"serial": serial, "operation": "request_service_change"},
             )
 
-        request_id = str(uuid.uuid4())
+        request_id = _new_request_id()
         message = {
             "type": "SET_SERVICE",
             "service": service,
-            "request_id": request_id,
-            "reply_port": self.settings.reply_port,
+            "request_id": f"{request_id:016x}",
+            "reply_port": self._reply_port,
         }
         if config:
             message["config"] = config
 
-        pending = PendingRequest()
-        with self.pending_lock:
-            self.pending[request_id] = pending
+        pending = self._register_pending(request_id, serial, loop=asyncio.get_running_loop())
 
-        self._send_command(device["ip"], message, serial, f"SET_SERVICE({service})")
+        self._send_command(device["ip"], message, serial, f"SET_SERVICE({service})", request_id)
 
         try:
-            reply = pending.wait(timeout)
+            reply = await pending.wait_async(timeout)
         except TimeoutError:
-            with self.pending_lock:
-                self.pending.pop(request_id, None)
+            self.pending.pop(request_id, None)
             api_error(
                 504,
                 "el agente no respondió al cambio de servicio",
@@ -275,10 +460,10 @@ class BroadcastManager:
                 context={"serial": serial, "service": service},
             )
 
-        db.upsert_device(serial, desired_service=service, desired_config=config)
+        await asyncio.to_thread(db.upsert_device, serial, desired_service=service, desired_config=config)
         return reply
 
-    def request_power_action(self, serial: str, action: str, timeout: float = 10.0) -> Dict[str, Any]:
+    async def request_power_action(self, serial: str, action: str, timeout: float = 10.0) -> Dict[str, Any]:
         action = (action or "").lower()
         if action not in {"shutdown", "reboot"}:
             api_error(
@@ -304,25 +489,23 @@ class BroadcastManager:
                 context={"serial": serial, "operation": "request_power_action"},
             )
 
-        request_id = str(uuid.uuid4())
+        request_id = _new_request_id()
         message = {
             "type": "POWER",
             "action": action,
-            "request_id": request_id,
-            "reply_port": self.settings.reply_port,
+            "request_id": f"{request_id:016x}",
+            "reply_port": self._reply_port,
+            "binary_ack": True,
         }
 
-        pending = PendingRequest()
-        with self.pending_lock:
-            self.pending[request_id] = pending
+        pending = self._register_pending(request_id, serial, loop=asyncio.get_running_loop())
 
-        self._send_command(device["ip"], message, serial, f"POWER({action})")
+        self._send_command(device["ip"], message, serial, f"POWER({action})", request_id)
 
         try:
-            reply = pending.wait(timeout)
+            reply = await pending.wait_async(timeout)
         except TimeoutError:
-            with self.pending_lock:
-                self.pending.pop(request_id, None)
+            self.pending.pop(request_id, None)
             api_error(
                 504,
                 "el agente no confirmó la orden de energía",
@@ -332,61 +515,81 @@ class BroadcastManager:
 
         return reply or {"ok": False, "error": "sin respuesta"}
 
-    def request_index_update(self, serial: str, index: int, timeout: float = 10.0) -> Dict[str, Any]:
-        device = self.registry.get_device(serial)
-        if not device:
-            api_error(
-                400,
-                "dispositivo desconocido",
-                logger=LOGGER,
-                context={"serial": serial, "operation": "request_index_update"},
-            )
-        if not device.get("ip"):
+    def request_index_update_bulk(self, updates: Iterable[Tuple[str, int]]) -> List[str]:
+        """Send SET_INDEX to several agents at once without waiting for their ACKs.
+
+        The INDEX_ACK replies are handled by the listener like any other; agents
+        that never answer are expired by the reaper. Returns the serials that
+        were sent a command.
+        """
+        if not self.command_socket:
             api_error(
-                400,
-                "no se conoce la IP del dispositivo",
+                500,
+                "socket de comando no disponible",
                 logger=LOGGER,
-                context={"serial": serial, "operation": "request_index_update"},
+                context={"operation": "request_index_update_bulk"},
             )
-
-        with self.pending_lock:
+        targets: List[Tuple[str, str, int]] = []
+        for serial, index in updates:
+            device = self.registry.get_device(serial)
+            if not device or not device.get("ip"):
+                LOGGER.warning("Índice %s para %s omitido: IP desconocida", index, serial)
+                continue
             if serial in self.pending_index:
-                return {"ok": True, "pending": True}
-
-        request_id = str(uuid.uuid4())
-        message = {
-            "type": "SET_INDEX",
-            "index": int(index),
-            "request_id": request_id,
-            "reply_port": self.settings.reply_port,
-        }
-
-        pending = PendingRequest()
-        with self.pending_lock:
-            self.pending[request_id] = pending
-            self.pending_index.add(serial)
-
-        self._send_command(device["ip"], message, serial, f"SET_INDEX({index})")
+                continue
+            targets.append((serial, device["ip"], int(index)))
 
+        # Register every request before anything goes out, so a full pending
+        # table or a failed send leaves nothing half-registered behind.
+        datagrams: List[udp.Datagram] = []
+        sent: List[Tuple[int, str, int]] = []
         try:
-            reply = pending.wait(timeout)
-        except TimeoutError:
-            with self.pending_lock:
-                self.pending.pop(request_id, None)
-                self.pending_index.discard(serial)
+            for serial, ip, index in targets:
+                request_id = _new_request_id()
+                self._register_pending(request_id, serial, track_index=True)
+                sent.append((request_id, serial, index))
+                datagrams.append((self._set_index_datagram(index, request_id), (ip, self._command_port)))
+        except Exception:
+            self._drop_pending(sent, {"ok": False, "error": "no registrado"})
+            raise
+        try:
+            udp.send_many(self.command_socket, datagrams)
+        except Exception as exc:
+            self._drop_pending(sent, {"ok": False, "error": str(exc)})
             api_error(
-                504,
-                "el agente no confirmó la actualización de índice",
+                500,
+                "error enviando comando",
                 logger=LOGGER,
-                context={"serial": serial, "index": index},
+                context={"serials": [serial for _, serial, _ in sent], "label": "SET_INDEX", "error": str(exc)},
             )
-
-        with self.pending_lock:
+        for _, serial, index in sent:
+            LOGGER.info("Comando SET_INDEX(%s) → %s", index, serial)
+        return [serial for _, serial, _ in sent]
+
+    def _drop_pending(self, entries: Iterable[Tuple[int, str, int]], result: Dict[str, Any]) -> None:
+        for request_id, serial, _ in entries:
+            pending = self.pending.pop(request_id, None)
+            if pending:
+                pending.set(result)
             self.pending_index.discard(serial)
-        return reply or {"ok": False, "error": "sin respuesta"}
 
-    def _send_command(self, ip: str, message: Dict[str, Any], serial: str, label: str) -> None:
+    def _fail_pending(self, request_id: int, error: str) -> None:
+        pending = self.pending.pop(request_id, None)
+        if pending is None:
+            return
+        pending.set({"ok": False, "error": error})
+        if pending.serial:
+            self.pending_index.discard(pending.serial)
+
+    def _set_index_datagram(self, index: int, request_id: int) -> bytes:
+        return _SET_INDEX_TEMPLATE % (int(index), request_id, self._reply_port)
+
+    def _send_command(
+        self, ip: str, message: Union[Dict[str, Any], bytes], serial: str, label: str, request_id: int
+    ) -> None:
+        """Send one command; if it cannot go out, fail only its own pending slot."""
         if not self.command_socket:
+            self._fail_pending(request_id, "socket de comando no disponible")
             api_error(
                 500,
                 "socket de comando no disponible",
@@ -394,14 +597,11 @@ class BroadcastManager:
                 context={"serial": serial, "label": label},
             )
         try:
-            self.command_socket.sendto(json.dumps(message).encode("utf-8"), (ip, self.settings.broadcast_port))
+            data = message if isinstance(message, bytes) else jsoncodec.dumps(message)
+            self.command_socket.sendto(data, (ip, self._command_port))
             LOGGER.info("Comando %s → %s", label, serial)
         except Exception as exc:
-            with self.pending_lock:
-                for req_id, pending in list(self.pending.items()):
-                    if pending.payload is None:
-                        pending.set({"ok": False, "error": str(exc)})
-                        self.pending.pop(req_id, None)
+            self._fail_pending(request_id, str(exc))
             api_error(
                 500,
                 "error enviando comando",
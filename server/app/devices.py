@@ -1,28 +1,39 @@
 from __future__ import annotations
 
-from datetime import datetime
-from typing import Any, Dict, List
+import time
+from typing import Any, Dict, List, Optional, Tuple
 
-from ..db import list_devices as db_list_devices, get_device
+from ..db import devices_version, list_devices as db_list_devices, get_device
 from .registry import DeviceRegistry
 
+# UI pollers within this window share one payload unless a device changed meanwhile.
+DEVICES_CACHE_TTL_S = 0.5
+
+_payload_cache: Optional[Tuple[Tuple[int, int, int], float, List[Dict[str, Any]]]] = None
+
 
 def build_devices_payload(registry: DeviceRegistry) -> List[Dict[str, Any]]:
-    runtime_devices = registry.list_devices()
+    """Merged runtime + stored device list; callers must not mutate the result."""
+    global _payload_cache
+    key = (id(registry), registry.version, devices_version())
+    now = time.monotonic()
+    cached = _payload_cache
+    if cached is not None and cached[0] == key and now - cached[1] < DEVICES_CACHE_TTL_S:
+        return cached[2]
+    result = _merge_devices(registry)
+    _payload_cache = (key, now, result)
+    return result
+
+
+def _merge_devices(registry: DeviceRegistry) -> List[Dict[str, Any]]:
+    runtime_devices, online_after = registry.snapshot()
     desired_devices = {d["serial"]: d for d in db_list_devices()}
     result: List[Dict[str, Any]] = []
-    seen = set()
-
-    for dev in runtime_devices:
-        serial = dev.get("serial")
-        extra = desired_devices.get(serial or "") if serial else None
-        payload = dict(dev)
-        last_seen = payload.get("last_seen")
-        if isinstance(last_seen, (int, float)):
-            try:
-                payload["last_seen"] = datetime.fromtimestamp(last_seen).isoformat()
-            except Exception:
-                payload["last_seen"] = None
+
+    for serial, dev in runtime_devices.items():
+        extra = desired_devices.get(serial)
+        payload = {**dev, "online": dev.get("last_seen", 0.0) > online_after}
+        payload["last_seen"] = payload.pop("last_seen_iso", None)
         if extra:
             payload["desired_service"] = extra.get("desired_service")
             payload["desired_config"] = extra.get("desired_config")
@@ -32,11 +43,9 @@ def build_devices_payload(registry: DeviceRegistry) -> List[Dict[str, Any]]:
                 payload["index"] = extra.get("device_index")
                 payload["device_index"] = extra.get("device_index")
         result.append(payload)
-        if serial:
-            seen.add(serial)
 
     for serial, extra in desired_devices.items():
-        if serial in seen:
+        if serial in runtime_devices:
             continue
         result.append(
             {
@@ -17,6 +17,6 @@ def api_error(
     detail: Dict[str, Any] = {"error": message}
     if context:
         detail["context"] = context
-    if logger:
+    if logger and logger.isEnabledFor(logging.ERROR):
         logger.error("%s (status=%s) context=%s", message, status_code, context)
     raise HTTPException(status_code=status_code, detail=detail)
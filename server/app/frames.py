@@ -0,0 +1,88 @@
+"""Compact binary framing for fixed-field agent acknowledgements.
+
+Frames start with one of the type codes below. They are control bytes other
+than the whitespace (tab, LF, CR) a JSON document may open with, so the
+listener can tell both encodings apart by peeking at the first byte. Anything
+that does not fit the fixed schema (errors with free text, unknown types,
+request ids that are not 16 hex digits, indices outside int32) keeps
+travelling as JSON.
+
+server/app/frames.py and client/agent/frames.py must stay byte-for-byte
+identical; the server logs a warning at start-up when they differ.
+"""
+from __future__ import annotations
+
+import struct
+from typing import Any, Dict, Optional, Union
+
+TYPE_INDEX_ACK = 0x01
+TYPE_POWER_ACK = 0x02
+
+FLAG_OK = 0x01
+FLAG_HAS_INDEX = 0x02
+FLAG_REBOOT = 0x04
+
+# type code, request id, flags, index, serial length — followed by the serial.
+_HEADER = struct.Struct("!BQBiB")
+
+_TYPE_CODES = {"INDEX_ACK": TYPE_INDEX_ACK, "POWER_ACK": TYPE_POWER_ACK}
+_TYPE_NAMES = {code: name for name, code in _TYPE_CODES.items()}
+
+_INDEX_MIN = -(1 << 31)
+_INDEX_MAX = (1 << 31) - 1
+
+
+def is_frame(data: Union[bytes, memoryview]) -> bool:
+    return bool(data) and data[0] in _TYPE_NAMES
+
+
+def pack_ack(
+    kind: str,
+    request_id: Optional[str],
+    ok: bool,
+    serial: Optional[str],
+    *,
+    index: Optional[int] = None,
+    action: Optional[str] = None,
+) -> Optional[bytes]:
+    """Encode an ACK as a binary frame, or return None if it must go as JSON."""
+    type_code = _TYPE_CODES.get(kind)
+    if type_code is None or not request_id or len(request_id) != 16:
+        return None
+    try:
+        rid = int(request_id, 16)
+    except ValueError:
+        return None
+    serial_raw = (serial or "").encode("utf-8")
+    if len(serial_raw) > 255:
+        return None
+    flags = FLAG_OK if ok else 0
+    if index is not None:
+        if not isinstance(index, int) or not _INDEX_MIN <= index <= _INDEX_MAX:
+            return None
+        flags |= FLAG_HAS_INDEX
+    if action == "reboot":
+        flags |= FLAG_REBOOT
+    return _HEADER.pack(type_code, rid, flags, index or 0, len(serial_raw)) + serial_raw
+
+
+def unpack_ack(data: Union[bytes, memoryview]) -> Optional[Dict[str, Any]]:
+    """Decode a binary frame into the same dict shape as its JSON counterpart."""
+    if len(data) < _HEADER.size:
+        return None
+    type_code, rid, flags, index, serial_len = _HEADER.unpack_from(data)
+    kind = _TYPE_NAMES.get(type_code)
+    end = _HEADER.size + serial_len
+    if kind is None or len(data) < end:
+        return None
+    payload: Dict[str, Any] = {
+        "type": kind,
+        "request_id": f"{rid:016x}",
+        "serial": bytes(data[_HEADER.size:end]).decode("utf-8", "ignore") or None,
+        "ok": bool(flags & FLAG_OK),
+    }
+    if type_code == TYPE_INDEX_ACK:
+        payload["index"] = index if flags & FLAG_HAS_INDEX else None
+    elif type_code == TYPE_POWER_ACK:
+        payload["action"] = "reboot" if flags & FLAG_REBOOT else "shutdown"
+    return payload
@@ -0,0 +1,175 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from .. import db, jsoncodec
+from .devices import build_devices_payload
+from .registry import DeviceRegistry
+
+LOGGER = logging.getLogger("omi.server.push")
+
+# Devices go offline by ageing, with no event; re-check this often while a panel is open.
+ONLINE_SWEEP_S = 1.0
+# Changes arriving within this window of the first one go out in a single push.
+PUSH_COALESCE_S = 0.05
+
+# Which dashboard views each DB table feeds.
+_TABLE_TOPICS = {
+    "devices": ("devices", "clients"),
+    "service_configs": ("services",),
+}
+
+
+class UiHub:
+    """Pushes dashboard updates to browsers connected on ``/ws/ui``.
+
+    Change hooks fire on the listener or threadpool threads; they only mark a
+    topic dirty on the event loop, and a single task sends one envelope per
+    dirty topic to every socket. Devices travel as deltas against what was
+    last sent: whole device objects that changed plus the current order, so a
+    panel that joined from a newer snapshot can apply them as well.
+    """
+
+    def __init__(self, registry: DeviceRegistry) -> None:
+        self.registry = registry
+        self._clients: Set[WebSocket] = set()
+        self._dirty: Set[str] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        # Devices as last pushed, and the revision of that push.
+        self._sent_devices: Dict[str, Dict[str, Any]] = {}
+        self._sent_order: List[str] = []
+        self._devices_rev = 0
+        # Keeps join snapshots and deltas in order on every socket.
+        self._devices_lock: Optional[asyncio.Lock] = None
+
+    def start(self) -> None:
+        """Begin forwarding changes; must run on the event loop."""
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._devices_lock = asyncio.Lock()
+        self._task = self._loop.create_task(self._run())
+        self.registry.add_listener(self._on_registry_change)
+        db.add_change_listener(self._on_table_change)
+
+    async def stop(self) -> None:
+        self.registry.remove_listener(self._on_registry_change)
+        db.remove_change_listener(self._on_table_change)
+        self._loop = None
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for websocket in list(self._clients):
+            try:
+                await websocket.close()
+            except Exception:
+                pass
+        self._clients.clear()
+
+    async def serve(self, websocket: WebSocket) -> None:
+        """Keep ``websocket`` subscribed until the browser goes away."""
+        await websocket.accept()
+        async with self._devices_lock:
+            devices = await asyncio.to_thread(build_devices_payload, self.registry)
+            await websocket.send_text(_encode({"type": "devices_update", "rev": self._devices_rev, "data": devices}))
+            self._clients.add(websocket)
+        LOGGER.info("Panel conectado por WebSocket (%d activos)", len(self._clients))
+        try:
+            while True:
+                # Browsers never send anything; reading just notices the disconnect.
+                await websocket.receive_text()
+        except WebSocketDisconnect:
+            pass
+        finally:
+            self._clients.discard(websocket)
+            LOGGER.info("Panel desconectado (%d activos)", len(self._clients))
+
+    def _on_registry_change(self) -> None:
+        self._schedule(("devices",))
+
+    def _on_table_change(self, table: str) -> None:
+        self._schedule(_TABLE_TOPICS.get(table, ()))
+
+    def _schedule(self, topics: Iterable[str]) -> None:
+        loop = self._loop
+        if loop is None or not self._clients:
+            return
+        try:
+            loop.call_soon_threadsafe(self._mark_dirty, tuple(topics))
+        except RuntimeError:
+            # Loop closed during shutdown.
+            pass
+
+    def _mark_dirty(self, topics: Iterable[str]) -> None:
+        self._dirty.update(topics)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), ONLINE_SWEEP_S)
+            except asyncio.TimeoutError:
+                self._dirty.add("devices")
+            else:
+                # Heartbeat bursts and rescans mark topics many times; let them pile up.
+                await asyncio.sleep(PUSH_COALESCE_S)
+            self._wakeup.clear()
+            topics, self._dirty = self._dirty, set()
+            if not self._clients:
+                continue
+            for topic in sorted(topics):
+                try:
+                    if topic == "devices":
+                        async with self._devices_lock:
+                            message = await self._devices_patch()
+                            if message is not None:
+                                await self._send(message)
+                    else:
+                        await self._send(await self._envelope(topic))
+                except Exception:
+                    LOGGER.exception("Error enviando actualización '%s' al panel", topic)
+
+    async def _devices_patch(self) -> Optional[str]:
+        """Delta since the last push, or ``None`` when nothing visible changed."""
+        devices = await asyncio.to_thread(build_devices_payload, self.registry)
+        current = {dev["serial"]: dev for dev in devices}
+        order = [dev["serial"] for dev in devices]
+        upsert = [dev for serial, dev in current.items() if self._sent_devices.get(serial) != dev]
+        if not upsert and order == self._sent_order:
+            return None
+        self._sent_devices, self._sent_order = current, order
+        self._devices_rev += 1
+        # ``order`` lists every device; serials missing from it were removed.
+        return _encode({"type": "devices_patch", "rev": self._devices_rev, "upsert": upsert, "order": order})
+
+    async def _envelope(self, topic: str) -> str:
+        if topic == "clients":
+            data = await asyncio.to_thread(db.list_devices)
+        else:
+            # Presets are fetched per service; the browser reloads the ones it shows.
+            data = None
+        return _encode({"type": f"{topic}_update", "data": data})
+
+    async def _send(self, message: str) -> None:
+        clients = list(self._clients)
+        results = await asyncio.gather(
+            *(websocket.send_text(message) for websocket in clients),
+            return_exceptions=True,
+        )
+        for websocket, result in zip(clients, results):
+            if isinstance(result, Exception):
+                self._clients.discard(websocket)
+
+
+def _encode(message: Dict[str, Any]) -> str:
+    return jsoncodec.dumps(message).decode("utf-8")
@@ -1,28 +1,67 @@
 from __future__ import annotations
 
+import math
 import threading
 import time
-from typing import Any, Dict, List, Optional, Tuple
+from types import MappingProxyType
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
 
-from ..db import upsert_device, ensure_device_index, list_devices as db_list_devices, get_device as db_get_device
+from ..db import record_device_seen, list_devices as db_list_devices, get_device as db_get_device
+
+# Heartbeats from an unchanged device only refresh its stored row this often.
+PERSIST_INTERVAL_S = 60.0
+
+
+def _iso_timestamp(ts: float) -> Optional[str]:
+    """Same output as ``datetime.fromtimestamp(ts).isoformat()`` without building a datetime."""
+    try:
+        frac, seconds = math.modf(ts)
+        micros = round(frac * 1_000_000)
+        if micros >= 1_000_000:
+            seconds, micros = seconds + 1, micros - 1_000_000
+        elif micros < 0:
+            seconds, micros = seconds - 1, micros + 1_000_000
+        text = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(seconds))
+    except (OverflowError, OSError, ValueError):
+        return None
+    return f"{text}.{micros:06d}" if micros else text
 
 
 class DeviceRegistry:
-    """Thread-safe runtime registry of discovered agents."""
+    """Thread-safe runtime registry of discovered agents.
+
+    Each device is stored as a read-only snapshot that is replaced wholesale on
+    every update, so readers can keep a reference without copying it. The map
+    itself is copy-on-write too: writers publish a new dict under the lock and
+    readers just load the current one, never taking the lock.
+    """
 
     def __init__(self, status_ttl: float) -> None:
         self._ttl = status_ttl
-        self._devices: Dict[str, Dict[str, Any]] = {}
+        self._devices: Dict[str, Mapping[str, Any]] = {}
         self._lock = threading.Lock()
+        self._version = 0
+        # serial -> (host, device_index, monotonic time) of the last write to the DB.
+        self._persisted: Dict[str, Tuple[Optional[str], int, float]] = {}
+        # Bumped by invalidate_persisted; a write that straddles it must not be cached.
+        self._persisted_generation = 0
+        self._listeners: List[Callable[[], None]] = []
 
     def update_from_status(self, payload: Dict[str, Any], addr) -> Tuple[Optional[int], Optional[int]]:
         serial = payload.get("serial")
         if not serial:
             return None, None
-        assigned_index = ensure_device_index(serial)
+        host = payload.get("host")
+        now = time.monotonic()
+        with self._lock:
+            generation = self._persisted_generation
+            persisted = self._persisted.get(serial)
+        fresh = persisted is not None and persisted[0] == host and now - persisted[2] < PERSIST_INTERVAL_S
+        assigned_index = persisted[1] if fresh else record_device_seen(serial, host)
+        seen_at = time.time()
         info = {
             "serial": serial,
-            "host": payload.get("host"),
+            "host": host,
             "name": payload.get("name"),
             "index": assigned_index,
             "version": payload.get("version"),
@@ -31,12 +70,14 @@ class DeviceRegistry:
             "heartbeat": payload.get("heartbeat", {}),
             "service_state": payload.get("service_state"),
             "logical_service": payload.get("logical_service"),
-            "last_seen": time.time(),
+            "last_seen": seen_at,
+            "last_seen_iso": _iso_timestamp(seen_at),
             "ip": addr[0],
         }
         with self._lock:
-            self._devices[serial] = info
-        upsert_device(serial, host=info.get("host"), device_index=assigned_index)
+            self._publish(serial, info)
+            if not fresh and generation == self._persisted_generation:
+                self._persisted[serial] = (host, assigned_index, now)
         return assigned_index, payload.get("index")
 
     def update_services(
@@ -52,44 +93,75 @@ class DeviceRegistry:
         if services is None and service_state is None and transition is None:
             return
         with self._lock:
-            if serial not in self._devices:
+            current = self._devices.get(serial)
+            if current is None:
                 return
+            info = dict(current)
             if services is not None:
-                self._devices[serial]["services"] = services
+                info["services"] = services
             if service_state is not None:
-                self._devices[serial]["service_state"] = service_state
+                info["service_state"] = service_state
             elif transition is not None or progress is not None or stage is not None:
-                state = dict(self._devices[serial].get("service_state") or {})
+                state = dict(info.get("service_state") or {})
                 if transition is not None:
                     state["transition"] = bool(transition)
                 if progress is not None:
                     state["progress"] = progress
                 if stage is not None:
                     state["stage"] = stage
-                self._devices[serial]["service_state"] = state
-            self._devices[serial]["last_seen"] = time.time()
+                info["service_state"] = state
+            info["last_seen"] = time.time()
+            info["last_seen_iso"] = _iso_timestamp(info["last_seen"])
+            self._publish(serial, info)
 
     def update_index(self, serial: str, index: Optional[int]) -> None:
         if index is None:
             return
         with self._lock:
-            if serial in self._devices:
-                self._devices[serial]["index"] = int(index)
+            current = self._devices.get(serial)
+            if current is not None:
+                self._publish(serial, {**current, "index": int(index)})
+
+    def _publish(self, serial: str, info: Dict[str, Any]) -> None:
+        """Swap in a new map holding ``info`` for ``serial``; caller holds the lock."""
+        devices = dict(self._devices)
+        devices[serial] = MappingProxyType(info)
+        self._devices = devices
+        self._version += 1
+        for listener in self._listeners:
+            listener()
+
+    def add_listener(self, callback: Callable[[], None]) -> None:
+        """Register ``callback()`` to run after every published change (under the lock)."""
+        self._listeners = [*self._listeners, callback]
+
+    def remove_listener(self, callback: Callable[[], None]) -> None:
+        self._listeners = [listener for listener in self._listeners if listener != callback]
+
+    @property
+    def version(self) -> int:
+        """Counter that changes whenever any device snapshot is replaced."""
+        return self._version
 
     def list_devices(self) -> List[Dict[str, Any]]:
         now = time.time()
+        return [
+            {**dev, "online": (now - dev.get("last_seen", 0.0)) < self._ttl}
+            for dev in self._devices.values()
+        ]
+
+    def snapshot(self) -> Tuple[Mapping[str, Mapping[str, Any]], float]:
+        """Current device map, never mutated once published, and the ``last_seen`` cutoff for online."""
+        return self._devices, time.time() - self._ttl
+
+    def invalidate_persisted(self) -> None:
+        """Forget what was last written; call after indices change in the DB."""
         with self._lock:
-            devices = []
-            for dev in self._devices.values():
-                copy_dev = dict(dev)
-                copy_dev["online"] = (now - dev.get("last_seen", 0.0)) < self._ttl
-                devices.append(copy_dev)
-            return devices
-
-    def get_device(self, serial: str) -> Optional[Dict[str, Any]]:
-        with self._lock:
-            dev = self._devices.get(serial)
-            return dict(dev) if dev else None
+            self._persisted_generation += 1
+            self._persisted.clear()
+
+    def get_device(self, serial: str) -> Optional[Mapping[str, Any]]:
+        return self._devices.get(serial)
 
     @staticmethod
     def desired_devices() -> Dict[str, Dict[str, Any]]:
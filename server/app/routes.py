@@ -1,12 +1,17 @@
 from __future__ import annotations
 
+import gzip
+import hashlib
+import html
 import logging
-from typing import Dict
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Callable, Dict, Tuple
 
-from fastapi import APIRouter, Request
-from fastapi.responses import HTMLResponse
+from fastapi import APIRouter, Request, WebSocket
+from fastapi.responses import HTMLResponse, Response
 
-from .. import db
+from .. import db, jsoncodec
 from .broadcast import BroadcastManager
 from .devices import build_devices_payload
 from .models import ConfigPayload, DeviceDesiredPayload, NetworkAckPayload, PowerRequest, ServiceRequest
@@ -14,7 +19,13 @@ from .registry import DeviceRegistry
 from .settings import Settings
 from .errors import api_error
 from .network import NetworkManager
-from .web import render_index
+from .push import UiHub
+from .web import render_template
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
 
 LOGGER = logging.getLogger("omi.server.routes")
 
@@ -23,9 +34,15 @@ NAV_TEMPLATE = (
     '<button class="nav-link" data-view-btn="clients">Clientes</button>'
     '<button class="nav-link" data-view-btn="services">Servicios</button>'
 )
+INDEX_CACHE_CONTROL = "public, max-age=60"
+# JSON may be stored but must be revalidated; unchanged data then costs a 304.
+JSON_CACHE_CONTROL = "no-cache"
 
 router = APIRouter()
 
+# name -> (source, body, etag) for the polled JSON endpoints.
+_json_bodies: Dict[str, Tuple[Any, bytes, str]] = {}
+
 
 def _context(request: Request) -> Dict[str, object]:
     return request.app.state.context
@@ -45,55 +62,136 @@ def _manager(request: Request) -> BroadcastManager:
 def _network(request: Request) -> NetworkManager:
     return request.app.state.context["network"]
 
-@router.get("/", response_class=HTMLResponse)
-async def index(request: Request):
-    settings = _settings(request)
-    host = request.url.hostname or "server"
-    brand_html = f"OMI Control @ {host}".replace("&", "&amp;")
-    nav_html = NAV_TEMPLATE.format(cls=" active")
-    return render_index(
-        settings,
+def _hub(websocket: WebSocket) -> UiHub:
+    return websocket.app.state.context["hub"]
+
+@lru_cache(maxsize=2)
+def _index_page(web_root: Path) -> Dict[str, Tuple[bytes, str]]:
+    """Rendered dashboard per content coding, each with its own strong ETag.
+
+    The page does not depend on the request (app.js fills in the hostname), so
+    it is rendered and compressed once. ``br`` is only offered when the optional
+    ``brotli`` package is installed.
+    """
+    page = render_template(
+        web_root / "index.html",
         {
             "PAGE_TITLE": "OMI Control Server",
-            "BRAND_HTML": brand_html,
-            "NAV_LINKS": nav_html,
+            "BRAND_HTML": f"OMI Control @ <span data-host-label>{html.escape('server')}</span>",
+            "NAV_LINKS": NAV_TEMPLATE.format(cls=" active"),
         },
     )
+    body = page.encode("utf-8")
+    digest = hashlib.blake2b(body, digest_size=8).hexdigest()
+    # Different bytes need different strong validators (RFC 9110 §8.8.3).
+    pages = {
+        "identity": (body, f'"{digest}"'),
+        "gzip": (gzip.compress(body, compresslevel=9), f'"{digest}-gz"'),
+    }
+    if brotli is not None:
+        pages["br"] = (brotli.compress(body, quality=11), f'"{digest}-br"')
+    return pages
+
+
+def _json_body(name: str, source: Any, build: Callable[[], bytes]) -> Tuple[bytes, str]:
+    """Encoded body and ETag for ``name``, rebuilt only when ``source`` changes."""
+    cached = _json_bodies.get(name)
+    if cached is not None and cached[0] == source:
+        return cached[1], cached[2]
+    body = build()
+    etag = f'"{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+    if len(_json_bodies) >= 64:
+        # Config names come from the URL; do not let arbitrary ones pile up.
+        _json_bodies.clear()
+    _json_bodies[name] = (source, body, etag)
+    return body, etag
+
+
+def _etag_response(request: Request, body: bytes, etag: str) -> Response:
+    headers = {"ETag": etag, "Cache-Control": JSON_CACHE_CONTROL}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+@router.get("/", response_class=HTMLResponse)
+def index(request: Request):
+    # Plain def: the one-off compression on first use runs in the threadpool, not on the loop.
+    settings = _settings(request)
+    pages = _index_page(settings.web_root)
+    accepted = {part.split(";", 1)[0].strip() for part in request.headers.get("accept-encoding", "").split(",")}
+    coding = next((c for c in ("br", "gzip") if c in accepted and c in pages), "identity")
+    body, etag = pages[coding]
+    headers = {"ETag": etag, "Cache-Control": INDEX_CACHE_CONTROL, "Vary": "Accept-Encoding"}
+    if coding != "identity":
+        headers["Content-Encoding"] = coding
+    if etag in (tag.strip() for tag in request.headers.get("if-none-match", "").split(",")):
+        return Response(status_code=304, headers=headers)
+    return HTMLResponse(body, headers=headers)
 
 
 @router.get("/api/devices")
-async def api_devices(request: Request):
+def api_devices(request: Request):
     registry = _registry(request)
-    return {"devices": build_devices_payload(registry)}
+    devices = build_devices_payload(registry)
+    body, etag = _json_body("devices", devices, lambda: jsoncodec.dumps({"devices": devices}))
+    return _etag_response(request, body, etag)
+
+
+@router.websocket("/ws/ui")
+async def ws_ui(websocket: WebSocket):
+    await _hub(websocket).serve(websocket)
 
 
 @router.get("/api/clients")
-async def api_clients():
-    return {"clients": db.list_devices()}
+def api_clients(request: Request):
+    body, etag = _json_body("clients", db.devices_version(), lambda: jsoncodec.dumps({"clients": db.list_devices()}))
+    return _etag_response(request, body, etag)
 
 
 @router.post("/api/devices/{serial}/service")
 async def api_set_service(serial: str, payload: ServiceRequest, request: Request):
     manager = _manager(request)
-    reply = manager.request_service_change(serial, payload.service, config=payload.config)
+    reply = await manager.request_service_change(serial, payload.service, config=payload.config)
     return reply
 
 
 @router.post("/api/devices/{serial}/power")
 async def api_power(serial: str, payload: PowerRequest, request: Request):
     manager = _manager(request)
-    reply = manager.request_power_action(serial, payload.action)
+    reply = await manager.request_power_action(serial, payload.action)
     return reply
 
 
+def _configs_body(rows) -> bytes:
+    """Build ``{"configs": [...]}`` splicing each stored ``data`` JSON in verbatim."""
+    items = []
+    for row in rows:
+        meta = jsoncodec.dumps(
+            {
+                "service_id": row["service_id"],
+                "name": row["name"],
+                "updated_at": row["updated_at"],
+                "updated_by": row["updated_by"],
+            }
+        )
+        items.append(meta[:-1] + b',"data":' + row["data"].encode("utf-8") + b"}")
+    return b'{"configs":[' + b",".join(items) + b"]}"
+
+
 @router.get("/api/configs/{service_id}")
-async def api_list_service_configs(service_id: str):
+def api_list_service_configs(service_id: str, request: Request):
     LOGGER.info("API GET /api/configs/%s", service_id)
-    return {"configs": db.list_configs(service_id)}
+    body, etag = _json_body(
+        f"configs/{service_id}",
+        db.configs_version(),
+        lambda: _configs_body(db.list_configs_raw(service_id)),
+    )
+    return _etag_response(request, body, etag)
 
 
 @router.get("/api/configs/{service_id}/{name}")
-async def api_get_service_config(service_id: str, name: str):
+def api_get_service_config(service_id: str, name: str):
     LOGGER.info("API GET /api/configs/%s/%s", service_id, name)
     cfg = db.get_config(service_id, name)
     if not cfg:
@@ -107,7 +205,7 @@ async def api_get_service_config(service_id: str, name: str):
 
 
 @router.post("/api/configs/{service_id}")
-async def api_save_service_config(service_id: str, payload: ConfigPayload):
+def api_save_service_config(service_id: str, payload: ConfigPayload):
     LOGGER.info(
         "API POST /api/configs/%s → name=%s overwrite=%s serial=%s",
         service_id,
@@ -128,14 +226,14 @@ async def api_save_service_config(service_id: str, payload: ConfigPayload):
 
 
 @router.delete("/api/configs/{service_id}/{name}")
-async def api_delete_service_config(service_id: str, name: str):
+def api_delete_service_config(service_id: str, name: str):
     LOGGER.info("API DELETE /api/configs/%s/%s", service_id, name)
     db.delete_config(service_id, name)
     return {"ok": True}
 
 
 @router.put("/api/devices/{serial}")
-async def api_update_device(serial: str, payload: DeviceDesiredPayload, request: Request):
+def api_update_device(serial: str, payload: DeviceDesiredPayload, request: Request):
     LOGGER.info(
         "API PUT /api/devices/%s → desired_service=%s desired_config=%s",
         serial,
@@ -170,14 +268,17 @@ async def api_network_ack(serial: str, payload: NetworkAckPayload, request: Requ
 
 
 @router.delete("/api/devices/{serial}")
-async def api_delete_device(serial: str, request: Request):
+def api_delete_device(serial: str, request: Request):
     LOGGER.info("API DELETE /api/devices/%s", serial)
     db.delete_device(serial)
     registry = _registry(request)
+    registry.invalidate_persisted()
+    stored_by_serial = {stored["serial"]: stored for stored in db.list_devices()}
+    updates = []
     for dev in registry.list_devices():
         if not dev.get("online"):
             continue
-        stored = registry.db_device(dev.get("serial", ""))
+        stored = stored_by_serial.get(dev.get("serial", ""))
         if not stored:
             continue
         desired_index = stored.get("device_index")
@@ -185,9 +286,16 @@ async def api_delete_device(serial: str, request: Request):
             continue
         if dev.get("index") != desired_index:
             LOGGER.info(
-                "Índice pendiente para %s (runtime=%s, deseado=%s); se sincronizará en el próximo heartbeat.",
+                "Índice pendiente para %s (runtime=%s, deseado=%s)",
                 dev.get("serial"),
                 dev.get("index"),
                 desired_index,
             )
+            updates.append((dev["serial"], desired_index))
+    if updates:
+        # The device is already gone; agents that miss SET_INDEX are re-sent it on their next status.
+        try:
+            _manager(request).request_index_update_bulk(updates)
+        except Exception:
+            LOGGER.exception("No se pudieron reenviar los índices tras borrar %s", serial)
     return {"ok": True}
@@ -0,0 +1,100 @@
+"""Batched UDP sends.
+
+On Linux the datagrams go out in a single ``sendmmsg(2)`` call; elsewhere (or
+for non-IPv4 destinations) they fall back to one ``sendto`` each.
+"""
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import os
+import socket
+from typing import List, Sequence, Tuple
+
+Datagram = Tuple[bytes, Tuple[str, int]]
+
+
+class _IOVec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class _SockAddrIn(ctypes.Structure):
+    _fields_ = [
+        ("sin_family", ctypes.c_ushort),
+        ("sin_port", ctypes.c_uint16),
+        ("sin_addr", ctypes.c_ubyte * 4),
+        ("sin_zero", ctypes.c_ubyte * 8),
+    ]
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(_IOVec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", _MsgHdr), ("msg_len", ctypes.c_uint)]
+
+
+def _load_sendmmsg():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        func = libc.sendmmsg
+    except (OSError, AttributeError, TypeError):
+        return None
+    func.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+    func.restype = ctypes.c_int
+    return func
+
+
+_sendmmsg = _load_sendmmsg()
+
+
+def send_many(sock: socket.socket, datagrams: Sequence[Datagram]) -> None:
+    """Send every datagram through ``sock``, batching the syscalls when possible."""
+    if not datagrams:
+        return
+    if _sendmmsg is None or len(datagrams) == 1 or sock.family != socket.AF_INET:
+        _send_each(sock, datagrams)
+        return
+    try:
+        addrs = [
+            _SockAddrIn(socket.AF_INET, socket.htons(port), (ctypes.c_ubyte * 4).from_buffer_copy(socket.inet_aton(ip)))
+            for _, (ip, port) in datagrams
+        ]
+    except OSError:
+        _send_each(sock, datagrams)
+        return
+
+    buffers: List[ctypes.Array] = [(ctypes.c_char * len(data)).from_buffer_copy(data) for data, _ in datagrams]
+    iovecs = (_IOVec * len(datagrams))()
+    msgs = (_MMsgHdr * len(datagrams))()
+    for i, buf in enumerate(buffers):
+        iovecs[i].iov_base = ctypes.addressof(buf)
+        iovecs[i].iov_len = len(buf)
+        hdr = msgs[i].msg_hdr
+        hdr.msg_name = ctypes.addressof(addrs[i])
+        hdr.msg_namelen = ctypes.sizeof(_SockAddrIn)
+        hdr.msg_iov = ctypes.pointer(iovecs[i])
+        hdr.msg_iovlen = 1
+
+    sent = 0
+    fd = sock.fileno()
+    while sent < len(datagrams):
+        count = _sendmmsg(fd, ctypes.addressof(msgs[sent]), len(datagrams) - sent, 0)
+        if count < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        sent += count
+
+
+def _send_each(sock: socket.socket, datagrams: Sequence[Datagram]) -> None:
+    for data, addr in datagrams:
+        sock.sendto(data, addr)
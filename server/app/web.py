@@ -1,15 +1,94 @@
 from __future__ import annotations
 
+import re
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict
+from typing import Any, Dict, Tuple
 
-from fastapi.responses import HTMLResponse
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
 
-from .settings import Settings
+from .. import jsoncodec
 
+_PLACEHOLDER = re.compile(r"\{\{(\w+)\}\}")
 
-def render_index(settings: Settings, context: Dict[str, str]) -> HTMLResponse:
-    template = (settings.web_root / "index.html").read_text(encoding="utf-8")
-    for key, value in context.items():
-        template = template.replace(f"{{{{{key}}}}}", value)
-    return HTMLResponse(template)
+# Largest request body accepted; configs and device updates are a few KiB at most.
+MAX_BODY_BYTES = 1 << 20
+
+
+@lru_cache(maxsize=8)
+def _template_segments(path: Path) -> Tuple[Tuple[str, bool], ...]:
+    """Read a template once and split it into (text, is_placeholder) segments."""
+    parts = _PLACEHOLDER.split(path.read_text(encoding="utf-8"))
+    return tuple((part, idx % 2 == 1) for idx, part in enumerate(parts))
+
+
+def render_template(path: Path, context: Dict[str, str]) -> str:
+    return "".join(
+        context.get(text, f"{{{{{text}}}}}") if is_placeholder else text
+        for text, is_placeholder in _template_segments(path)
+    )
+
+
+class CodecJSONResponse(JSONResponse):
+    """JSON response encoded by jsoncodec, so orjson is used when it is installed."""
+
+    def render(self, content: Any) -> bytes:
+        return jsoncodec.dumps(content)
+
+
+class BodySizeLimit:
+    """ASGI middleware answering 413 to request bodies larger than ``max_bytes``.
+
+    A declared Content-Length is checked up front. Chunked bodies carry none,
+    so their bytes are counted as the app reads them and the read fails once
+    past the limit.
+    """
+
+    def __init__(self, app, max_bytes: int = MAX_BODY_BYTES) -> None:
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                if not value.isdigit() or int(value) > self.max_bytes:
+                    await self._too_large()(scope, receive, send)
+                    return
+                # The server never hands over more than the declared length.
+                await self.app(scope, receive, send)
+                return
+
+        received = 0
+        started = False
+
+        async def counting_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise HTTPException(status_code=413, detail=self._detail())
+            return message
+
+        async def tracking_send(message) -> None:
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        try:
+            await self.app(scope, counting_receive, tracking_send)
+        except HTTPException as exc:
+            if exc.status_code != 413 or started:
+                raise
+            await self._too_large()(scope, receive, send)
+
+    def _detail(self) -> Dict[str, Any]:
+        return {"error": "cuerpo de la petición demasiado grande", "context": {"max_bytes": self.max_bytes}}
+
+    def _too_large(self) -> JSONResponse:
+        return JSONResponse({"detail": self._detail()}, status_code=413)
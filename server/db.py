@@ -1,23 +1,317 @@
 """SQLite persistence for OMI control server."""
 from __future__ import annotations
 
-import json
+import queue
 import sqlite3
+import threading
+import time
 from contextlib import contextmanager
+from functools import lru_cache
 from pathlib import Path
-from typing import Any, Dict, Iterable, List, Optional
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from . import jsoncodec
 
 DB_PATH = Path(__file__).resolve().parent / "omi.db"
 
+_WRITER_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+)
+_PRAGMAS = (
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-64000",
+    "PRAGMA mmap_size=134217728",
+)
+
+_CACHED_STATEMENTS = 256
+# RETURNING arrived in SQLite 3.35; Raspberry Pi OS bullseye ships 3.34.
+_HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+# UPDATE ... FROM arrived in 3.33; older libraries resequence row by row.
+_HAS_UPDATE_FROM = sqlite3.sqlite_version_info >= (3, 33, 0)
+_BUSY_TIMEOUT_S = 5.0
+_READER_POOL_SIZE = 4
+
+# Hot-path SQL lives in constants so every call hands sqlite3 the same text
+# and hits its compiled-statement cache instead of re-parsing.
+SQL_SAVE_CONFIG = """
+    INSERT INTO service_configs (service_id, name, data, updated_at, updated_by)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(service_id, name) DO UPDATE SET
+        data=excluded.data,
+        updated_at=excluded.updated_at,
+        updated_by=excluded.updated_by
+"""
+SQL_LIST_CONFIGS = (
+    "SELECT service_id, name, data, updated_at, updated_by FROM service_configs WHERE service_id = ? ORDER BY name"
+)
+SQL_GET_CONFIG = "SELECT data, updated_at, updated_by FROM service_configs WHERE service_id = ? AND name = ?"
+SQL_DELETE_CONFIG = "DELETE FROM service_configs WHERE service_id = ? AND name = ?"
+
+SQL_GET_DEVICE_INDEX = "SELECT serial, device_index FROM devices WHERE serial = ?"
+# Smallest positive device_index not in use; every probe is served by idx_devices_device_index.
+_NEXT_DEVICE_INDEX_EXPR = """
+    CASE
+        WHEN NOT EXISTS (SELECT 1 FROM devices WHERE device_index = 1) THEN 1
+        ELSE (
+            SELECT MIN(t.device_index + 1)
+            FROM devices t
+            WHERE t.device_index >= 1
+              AND NOT EXISTS (SELECT 1 FROM devices n WHERE n.device_index = t.device_index + 1)
+        )
+    END
+"""
+SQL_NEXT_DEVICE_INDEX = "SELECT " + _NEXT_DEVICE_INDEX_EXPR
+_UPSERT_FIELDS = ("host", "desired_service", "desired_config", "network_profile")
+
+
+@lru_cache(maxsize=None)
+def _upsert_device_sql(mask: int, has_index: bool, returning: bool = False) -> str:
+    """UPSERT that only overwrites the fields whose bit is set in ``mask``.
+
+    One string per variant, so each is compiled once by the statement cache.
+    When the caller supplies the index, the stored/next-free lookups are left
+    out of the statement altogether.
+    """
+    index_expr = (
+        "?"
+        if has_index
+        else f"COALESCE((SELECT device_index FROM devices WHERE serial = ?), {_NEXT_DEVICE_INDEX_EXPR})"
+    )
+    updates = [f"{field} = excluded.{field}" for bit, field in enumerate(_UPSERT_FIELDS) if mask & (1 << bit)]
+    updates += ["device_index = excluded.device_index", "updated_at = excluded.updated_at"]
+    return f"""
+    INSERT INTO devices(
+        serial,
+        host,
+        desired_service,
+        desired_config,
+        network_profile,
+        device_index,
+        created_at,
+        updated_at
+    )
+    VALUES (
+        ?, ?, ?, ?, ?,
+        {index_expr},
+        ?,
+        ?
+    )
+    ON CONFLICT(serial) DO UPDATE SET {", ".join(updates)}
+    {"RETURNING device_index" if returning else ""}
+"""
+
+
+SQL_INSERT_DEVICE = """
+    INSERT INTO devices(serial, device_index, created_at, updated_at)
+    VALUES (?, ?, ?, ?)
+"""
+SQL_SET_DEVICE_INDEX = "UPDATE devices SET device_index = ?, updated_at = ? WHERE serial = ?"
+# Only rows whose position actually moves are rewritten, keeping the WAL small.
+SQL_RESEQUENCE_DEVICES = """
+    WITH ranked AS (
+        SELECT serial, row_number() OVER (ORDER BY device_index, serial) AS rn
+        FROM devices
+    )
+    UPDATE devices
+    SET device_index = ranked.rn
+    FROM ranked
+    WHERE ranked.serial = devices.serial AND devices.device_index IS NOT ranked.rn
+"""
+SQL_LIST_DEVICE_ORDER = "SELECT serial, device_index FROM devices ORDER BY device_index, serial"
+SQL_MOVE_DEVICE_INDEX = "UPDATE devices SET device_index = ? WHERE serial = ?"
+SQL_DELETE_DEVICE = "DELETE FROM devices WHERE serial = ?"
+_DEVICE_COLUMNS = (
+    "serial",
+    "host",
+    "desired_service",
+    "desired_config",
+    "network_profile",
+    "device_index",
+    "created_at",
+    "updated_at",
+)
+_DEVICE_SELECT = f"SELECT {', '.join(_DEVICE_COLUMNS)} FROM devices "
+SQL_GET_DEVICE = _DEVICE_SELECT + "WHERE serial = ?"
+SQL_LIST_DEVICES = _DEVICE_SELECT + "ORDER BY updated_at DESC"
+
+_CONN: Optional[sqlite3.Connection] = None
+_LOCK = threading.RLock()
+
+# Read-only connections for queries; under WAL they never wait for the writer.
+_READERS: "queue.SimpleQueue[sqlite3.Connection]" = queue.SimpleQueue()
+_READERS_LOCK = threading.Lock()
+_readers_open = 0
+
+# Bumped after every committed write to the devices table; lets callers cache reads.
+_devices_version = 0
+# Same for service_configs, plus get_config results tagged with the version they were read at.
+_configs_version = 0
+_CONFIG_CACHE_MAX = 256
+_config_cache: Dict[Tuple[str, str], Tuple[int, Optional[Dict[str, Any]]]] = {}
+# Called with the table name after each committed write to devices/service_configs.
+_change_listeners: List[Callable[[str], None]] = []
+
 
 def _connect() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH)
+    """Return the process-wide writer connection, opening it on first use."""
+    global _CONN
+    with _LOCK:
+        if _CONN is None:
+            conn = sqlite3.connect(
+                DB_PATH,
+                timeout=_BUSY_TIMEOUT_S,
+                check_same_thread=False,
+                isolation_level=None,
+                cached_statements=_CACHED_STATEMENTS,
+            )
+            conn.row_factory = sqlite3.Row
+            for pragma in _WRITER_PRAGMAS + _PRAGMAS:
+                conn.execute(pragma)
+            _CONN = conn
+        return _CONN
+
+
+def _open_reader() -> sqlite3.Connection:
+    _connect()  # the database file and its WAL must exist before a read-only open
+    conn = sqlite3.connect(
+        f"{DB_PATH.as_uri()}?mode=ro",
+        uri=True,
+        timeout=_BUSY_TIMEOUT_S,
+        check_same_thread=False,
+        isolation_level=None,
+        cached_statements=_CACHED_STATEMENTS,
+    )
     conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA query_only=ON")
+    for pragma in _PRAGMAS:
+        conn.execute(pragma)
     return conn
 
 
+def _fill_reader_pool() -> None:
+    """Open the remaining reader connections up front so no request pays for it."""
+    global _readers_open
+    while True:
+        with _READERS_LOCK:
+            if _readers_open >= _READER_POOL_SIZE:
+                return
+            _readers_open += 1
+        try:
+            conn = _open_reader()
+        except Exception:
+            with _READERS_LOCK:
+                _readers_open -= 1
+            raise
+        _READERS.put(conn)
+
+
+@contextmanager
+def _reading() -> Iterator[sqlite3.Connection]:
+    global _readers_open
+    try:
+        conn = _READERS.get_nowait()
+    except queue.Empty:
+        with _READERS_LOCK:
+            spawn = _readers_open < _READER_POOL_SIZE
+            if spawn:
+                _readers_open += 1
+        if spawn:
+            try:
+                conn = _open_reader()
+            except Exception:
+                with _READERS_LOCK:
+                    _readers_open -= 1
+                raise
+        else:
+            conn = _READERS.get()
+    try:
+        yield conn
+    finally:
+        _READERS.put(conn)
+
+
+@contextmanager
+def _writing() -> Iterator[sqlite3.Connection]:
+    with _LOCK:
+        conn = _connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+
+@contextmanager
+def _writing_devices() -> Iterator[sqlite3.Connection]:
+    global _devices_version
+    # Bump right after COMMIT, still inside the writer's critical section, so
+    # every committed write has its own version before the next one can start.
+    with _LOCK:
+        with _writing() as conn:
+            yield conn
+        _devices_version += 1
+    _notify_change("devices")
+
+
+def devices_version() -> int:
+    """Counter that changes whenever the devices table has been written."""
+    return _devices_version
+
+
+def configs_version() -> int:
+    """Counter that changes whenever the service_configs table has been written."""
+    return _configs_version
+
+
+@contextmanager
+def _writing_configs() -> Iterator[sqlite3.Connection]:
+    global _configs_version
+    with _LOCK:
+        with _writing() as conn:
+            yield conn
+        _configs_version += 1
+        _config_cache.clear()
+    _notify_change("service_configs")
+
+
+def add_change_listener(callback: Callable[[str], None]) -> None:
+    """Register ``callback(table)``; it runs on the writing thread, so keep it short."""
+    _change_listeners.append(callback)
+
+
+def remove_change_listener(callback: Callable[[str], None]) -> None:
+    try:
+        _change_listeners.remove(callback)
+    except ValueError:
+        pass
+
+
+def _notify_change(table: str) -> None:
+    for callback in tuple(_change_listeners):
+        callback(table)
+
+
+def close_db() -> None:
+    global _CONN, _readers_open
+    with _READERS_LOCK:
+        while True:
+            try:
+                _READERS.get_nowait().close()
+            except queue.Empty:
+                break
+            _readers_open -= 1
+    with _LOCK:
+        if _CONN is not None:
+            _CONN.close()
+            _CONN = None
+    _config_cache.clear()
+
+
 def init_db() -> None:
-    with _connect() as conn:
+    with _writing() as conn:
         conn.execute(
             """
             CREATE TABLE IF NOT EXISTS service_configs (
@@ -49,9 +343,16 @@ def init_db() -> None:
         except sqlite3.OperationalError:
             pass
         _ensure_column(conn, "devices", "network_profile", "TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_devices_device_index ON devices(device_index)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_devices_updated_at ON devices(updated_at DESC)")
+        # Covers every column the config queries read, so rows come straight from the index.
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_service_configs_cover "
+            "ON service_configs(service_id, name, data, updated_at, updated_by)"
+        )
         conn.execute("UPDATE service_configs SET service_id = 'OSCnum' WHERE service_id = 'OSC'")
         conn.execute("UPDATE devices SET desired_service = 'OSCnum' WHERE desired_service = 'OSC'")
-        conn.commit()
+    _fill_reader_pool()
 
 
 def _ensure_column(conn: sqlite3.Connection, table: str, column: str, declaration: str) -> None:
@@ -64,94 +365,79 @@ def _ensure_column(conn: sqlite3.Connection, table: str, column: str, declaratio
 def _serialize_json(payload: Optional[Dict[str, Any]]) -> Optional[str]:
     if payload is None:
         return None
-    return json.dumps(payload)
+    return jsoncodec.dumps(payload).decode("utf-8")
 
 
+@lru_cache(maxsize=256)
 def _deserialize_json(raw: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Parse a stored JSON column; memoised by its text, so treat the result as read-only."""
     if raw is None:
         return None
     try:
-        data = json.loads(raw)
+        data = jsoncodec.loads(raw)
     except Exception:
         return None
     return data
 
 
+def _now() -> str:
+    """UTC timestamp in the same text format SQLite's ``datetime('now')`` produces."""
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+
+
 def _next_device_index(conn: sqlite3.Connection) -> int:
-    rows = conn.execute("SELECT device_index FROM devices WHERE device_index IS NOT NULL ORDER BY device_index").fetchall()
-    used = {row["device_index"] for row in rows if row["device_index"] is not None}
-    candidate = 1
-    while candidate in used:
-        candidate += 1
-    return candidate
+    row = conn.execute(SQL_NEXT_DEVICE_INDEX).fetchone()
+    return row[0] or 1
 
 
 def _resequence_device_indices(conn: sqlite3.Connection) -> None:
-    rows = conn.execute("SELECT serial FROM devices ORDER BY device_index, serial").fetchall()
-    for idx, row in enumerate(rows, start=1):
-        conn.execute("UPDATE devices SET device_index = ? WHERE serial = ?", (idx, row["serial"]))
+    if _HAS_UPDATE_FROM:
+        conn.execute(SQL_RESEQUENCE_DEVICES)
+        return
+    rows = conn.execute(SQL_LIST_DEVICE_ORDER).fetchall()
+    conn.executemany(
+        SQL_MOVE_DEVICE_INDEX,
+        [(position, row[0]) for position, row in enumerate(rows, 1) if row[1] != position],
+    )
 
 
 def save_config(service_id: str, name: str, data: Dict[str, Any], updated_by: Optional[str]) -> None:
-    with _connect() as conn:
-        conn.execute(
-            """
-            INSERT INTO service_configs (service_id, name, data, updated_at, updated_by)
-            VALUES (?, ?, ?, datetime('now'), ?)
-            ON CONFLICT(service_id, name) DO UPDATE SET
-                data=excluded.data,
-                updated_at=excluded.updated_at,
-                updated_by=excluded.updated_by
-            """,
-            (service_id, name, json.dumps(data), updated_by),
-        )
-        conn.commit()
-
-
-def list_configs(service_id: str) -> List[Dict[str, Any]]:
-    with _connect() as conn:
-        rows = conn.execute(
-            "SELECT service_id, name, data, updated_at, updated_by FROM service_configs WHERE service_id = ? ORDER BY name",
-            (service_id,),
-        ).fetchall()
-    result = []
-    for row in rows:
-        payload = json.loads(row["data"])
-        result.append(
-            {
-                "service_id": row["service_id"],
-                "name": row["name"],
-                "data": payload,
-                "updated_at": row["updated_at"],
-                "updated_by": row["updated_by"],
-            }
-        )
-    return result
+    with _writing_configs() as conn:
+        conn.execute(SQL_SAVE_CONFIG, (service_id, name, jsoncodec.dumps(data).decode("utf-8"), _now(), updated_by))
+
+
+def list_configs_raw(service_id: str) -> List[sqlite3.Row]:
+    """Rows for ``service_id`` with ``data`` left as the stored JSON text."""
+    with _reading() as conn:
+        return conn.execute(SQL_LIST_CONFIGS, (service_id,)).fetchall()
 
 
 def get_config(service_id: str, name: str) -> Optional[Dict[str, Any]]:
-    with _connect() as conn:
-        row = conn.execute(
-            "SELECT data, updated_at, updated_by FROM service_configs WHERE service_id = ? AND name = ?",
-            (service_id, name),
-        ).fetchone()
-    if not row:
-        return None
-    payload = json.loads(row["data"])
-    return {
-        "data": payload,
-        "updated_at": row["updated_at"],
-        "updated_by": row["updated_by"],
-    }
+    """Stored config or ``None``; results are cached, so callers must not mutate them."""
+    key = (service_id, name)
+    version = _configs_version
+    cached = _config_cache.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    with _reading() as conn:
+        row = conn.execute(SQL_GET_CONFIG, (service_id, name)).fetchone()
+    config = None
+    if row:
+        config = {
+            "data": jsoncodec.loads(row["data"]),
+            "updated_at": row["updated_at"],
+            "updated_by": row["updated_by"],
+        }
+    if len(_config_cache) >= _CONFIG_CACHE_MAX:
+        _config_cache.clear()
+    # Tagged with the version seen before the read: a write that lands meanwhile makes it stale.
+    _config_cache[key] = (version, config)
+    return config
 
 
 def delete_config(service_id: str, name: str) -> None:
-    with _connect() as conn:
-        conn.execute(
-            "DELETE FROM service_configs WHERE service_id = ? AND name = ?",
-            (service_id, name),
-        )
-        conn.commit()
+    with _writing_configs() as conn:
+        conn.execute(SQL_DELETE_CONFIG, (service_id, name))
 
 
 def upsert_device(
@@ -165,119 +451,59 @@ def upsert_device(
 ) -> None:
     if desired_service == "OSC":
         desired_service = "OSCnum"
-    with _connect() as conn:
-        existing = conn.execute(
-            "SELECT serial, device_index FROM devices WHERE serial = ?",
-            (serial,),
-        ).fetchone()
-        current_index = existing["device_index"] if existing else None
-        if existing and current_index is None and device_index is None:
-            device_index = _next_device_index(conn)
-        if existing:
-            conn.execute(
-                """
-                UPDATE devices
-                SET host = COALESCE(?, host),
-                    desired_service = COALESCE(?, desired_service),
-                    desired_config = COALESCE(?, desired_config),
-                    network_profile = COALESCE(?, network_profile),
-                    device_index = COALESCE(?, device_index),
-                    updated_at = datetime('now')
-                WHERE serial = ?
-                """,
-                (
-                    host,
-                    desired_service,
-                    desired_config,
-                    _serialize_json(network_profile),
-                    device_index,
-                    serial,
-                ),
-            )
-        else:
-            if device_index is None:
-                device_index = _next_device_index(conn)
-            conn.execute(
-                """
-                INSERT INTO devices(
-                    serial,
-                    host,
-                    desired_service,
-                    desired_config,
-                    network_profile,
-                    device_index,
-                    created_at,
-                    updated_at
-                )
-                VALUES (?, ?, ?, ?, ?, ?, datetime('now'), datetime('now'))
-                """,
-                (
-                    serial,
-                    host,
-                    desired_service,
-                    desired_config,
-                    _serialize_json(network_profile),
-                    device_index,
-                ),
-            )
-        conn.commit()
+    values = (host, desired_service, desired_config, _serialize_json(network_profile))
+    mask = sum(1 << bit for bit, value in enumerate(values) if value is not None)
+    now = _now()
+    with _writing_devices() as conn:
+        conn.execute(
+            _upsert_device_sql(mask, device_index is not None),
+            (serial, *values, serial if device_index is None else device_index, now, now),
+        )
 
 
-def get_device(serial: str) -> Optional[Dict[str, Any]]:
-    with _connect() as conn:
-        row = conn.execute(
-            """
-            SELECT
-                serial,
-                host,
-                desired_service,
-                desired_config,
-                network_profile,
-                device_index,
-                created_at,
-                updated_at
-            FROM devices
-            WHERE serial = ?
-            """,
-            (serial,),
-        ).fetchone()
-    if not row:
-        return None
-    payload = dict(row)
-    payload["network_profile"] = _deserialize_json(payload.get("network_profile"))
+def _device_from_tuple(row: tuple) -> Dict[str, Any]:
+    payload = dict(zip(_DEVICE_COLUMNS, row))
+    payload["network_profile"] = _deserialize_json(payload["network_profile"])
     return payload
 
 
+def _fetch_device_tuples(conn: sqlite3.Connection, sql: str, params: tuple = ()) -> List[tuple]:
+    """Run a device query returning plain tuples instead of ``sqlite3.Row`` objects."""
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    return cursor.execute(sql, params).fetchall()
+
+
+def record_device_seen(serial: str, host: Optional[str]) -> int:
+    """Store a heartbeat's host and return the device index, assigning one if needed.
+
+    Same effect as ``ensure_device_index`` followed by ``upsert_device`` in one statement.
+    """
+    now = _now()
+    params = (serial, host, None, None, None, serial, now, now)
+    with _writing_devices() as conn:
+        if _HAS_RETURNING:
+            return conn.execute(_upsert_device_sql(0 if host is None else 1, False, True), params).fetchone()[0]
+        conn.execute(_upsert_device_sql(0 if host is None else 1, False), params)
+        return conn.execute(SQL_GET_DEVICE_INDEX, (serial,)).fetchone()[1]
+
+
+def get_device(serial: str) -> Optional[Dict[str, Any]]:
+    with _reading() as conn:
+        rows = _fetch_device_tuples(conn, SQL_GET_DEVICE, (serial,))
+    return _device_from_tuple(rows[0]) if rows else None
+
+
 def delete_device(serial: str) -> None:
-    with _connect() as conn:
-        conn.execute("DELETE FROM devices WHERE serial = ?", (serial,))
+    with _writing_devices() as conn:
+        conn.execute(SQL_DELETE_DEVICE, (serial,))
         _resequence_device_indices(conn)
-        conn.commit()
 
 
 def list_devices() -> List[Dict[str, Any]]:
-    with _connect() as conn:
-        rows = conn.execute(
-            """
-            SELECT
-                serial,
-                host,
-                desired_service,
-                desired_config,
-                network_profile,
-                device_index,
-                created_at,
-                updated_at
-            FROM devices
-            ORDER BY updated_at DESC
-            """
-        ).fetchall()
-    result: List[Dict[str, Any]] = []
-    for row in rows:
-        payload = dict(row)
-        payload["network_profile"] = _deserialize_json(payload.get("network_profile"))
-        result.append(payload)
-    return result
+    with _reading() as conn:
+        rows = _fetch_device_tuples(conn, SQL_LIST_DEVICES)
+    return [_device_from_tuple(row) for row in rows]
 
 
 def save_device_network_profile(serial: str, profile: Optional[Dict[str, Any]]) -> None:
@@ -285,21 +511,12 @@ def save_device_network_profile(serial: str, profile: Optional[Dict[str, Any]])
 
 
 def ensure_device_index(serial: str) -> int:
-    with _connect() as conn:
-        row = conn.execute(
-            "SELECT device_index FROM devices WHERE serial = ?",
-            (serial,),
-        ).fetchone()
+    with _writing_devices() as conn:
+        row = conn.execute(SQL_GET_DEVICE_INDEX, (serial,)).fetchone()
         if not row:
             new_index = _next_device_index(conn)
-            conn.execute(
-                """
-                INSERT INTO devices(serial, host, desired_service, desired_config, device_index, created_at, updated_at)
-                VALUES (?, NULL, NULL, NULL, ?, datetime('now'), datetime('now'))
-                """,
-                (serial, new_index),
-            )
-            conn.commit()
+            now = _now()
+            conn.execute(SQL_INSERT_DEVICE, (serial, new_index, now, now))
             return new_index
 
         current = row["device_index"]
@@ -307,9 +524,5 @@ def ensure_device_index(serial: str) -> int:
             return current
 
         new_index = _next_device_index(conn)
-        conn.execute(
-            "UPDATE devices SET device_index = ?, updated_at = datetime('now') WHERE serial = ?",
-            (new_index, serial),
-        )
-        conn.commit()
+        conn.execute(SQL_SET_DEVICE_INDEX, (new_index, _now(), serial))
         return new_index
@@ -1,7 +1,8 @@
 """Logging helpers for the OMI control server."""
 from __future__ import annotations
 import logging
-from logging.handlers import RotatingFileHandler
+import threading
+from logging.handlers import MemoryHandler, RotatingFileHandler
 from pathlib import Path
 
 SERVER_ROOT = Path(__file__).resolve().parent
@@ -10,6 +11,28 @@ LOG_ROOT.mkdir(parents=True, exist_ok=True)
 
 _MAX_BYTES = 2_000_000
 _BACKUPS = 3
+# Records buffered before the file is written; WARNING and above flush at once.
+_BUFFER_RECORDS = 512
+# Buffered records reach the file at least this often, even on a quiet server.
+_FLUSH_INTERVAL_S = 5.0
+
+
+class _PeriodicMemoryHandler(MemoryHandler):
+    """MemoryHandler that also writes its buffer out every ``interval`` seconds."""
+
+    def __init__(self, capacity: int, interval: float, **kwargs) -> None:
+        super().__init__(capacity, **kwargs)
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, args=(interval,), name="omi-log-flush", daemon=True)
+        self._flusher.start()
+
+    def _flush_loop(self, interval: float) -> None:
+        while not self._stop.wait(interval):
+            self.flush()
+
+    def close(self) -> None:
+        self._stop.set()
+        super().close()
 
 
 def get_server_logger() -> logging.Logger:
@@ -17,14 +40,19 @@ def get_server_logger() -> logging.Logger:
     if logger.handlers:
         return logger
 
-    file_handler = RotatingFileHandler(LOG_ROOT / "server.log", maxBytes=_MAX_BYTES, backupCount=_BACKUPS, encoding="utf-8")
+    file_handler = RotatingFileHandler(
+        LOG_ROOT / "server.log", maxBytes=_MAX_BYTES, backupCount=_BACKUPS, encoding="utf-8", delay=True
+    )
     file_handler.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(name)s: %(message)s"))
+    buffered_handler = _PeriodicMemoryHandler(
+        _BUFFER_RECORDS, _FLUSH_INTERVAL_S, flushLevel=logging.WARNING, target=file_handler
+    )
 
     console_handler = logging.StreamHandler()
     console_handler.setFormatter(logging.Formatter("[%(levelname)s] %(message)s"))
 
     logger.setLevel(logging.INFO)
-    logger.addHandler(file_handler)
+    logger.addHandler(buffered_handler)
     logger.addHandler(console_handler)
     logger.propagate = False
     return logger
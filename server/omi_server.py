@@ -14,4 +14,15 @@ app = create_app()
 
 if __name__ == "__main__":
     settings = Settings()
-    uvicorn.run("server.omi_server:app", host="0.0.0.0", port=settings.http_port, reload=False)
+    # loop/http/ws "auto" already pick uvloop, httptools and websockets when they
+    # are installed (uvicorn[standard]) and fall back to asyncio/h11 otherwise.
+    uvicorn.run(
+        "server.omi_server:app",
+        host="0.0.0.0",
+        port=settings.http_port,
+        reload=False,
+        loop="auto",
+        http="auto",
+        ws="auto",
+        access_log=False,
+    )
@@ -92,10 +92,20 @@
     return date.toLocaleString();
   }
 
+  // url -> {etag, data}; a 304 hands back the very same object, so callers can skip rendering.
+  var etagCache = {};
+
   function getJson(url){
-    return fetch(url).then(function(res){
+    var cached = etagCache[url];
+    var options = cached ? { headers: { 'If-None-Match': cached.etag } } : {};
+    return fetch(url, options).then(function(res){
+      if(res.status === 304 && cached) return cached.data;
       if(!res.ok) throw new Error(url + ' => ' + res.status);
-      return res.json();
+      var etag = res.headers.get('ETag');
+      return res.json().then(function(data){
+        if(etag) etagCache[url] = { etag: etag, data: data };
+        return data;
+      });
     });
   }
 
@@ -335,39 +345,72 @@
     return cardParts.join('');
   }
 
+  // serial -> {html, node} for the cards currently shown in the devices view.
+  var deviceCards = {};
+
+  function readCardSelection(card){
+    var serviceSel = card.querySelector('select[data-service-select]');
+    var configSel = card.querySelector('select[data-config-for]');
+    return {
+      service: serviceSel ? serviceSel.value : null,
+      config: configSel ? configSel.value : null
+    };
+  }
+
   function renderDevices(devices){
     currentDevices = devices;
     var container = document.getElementById('devicesView');
-    var selectionSnapshot = {};
-    toArray(container.querySelectorAll('.card[data-serial]')).forEach(function(card){
-      var serial = card.dataset.serial;
-      if(!serial) return;
-      var serviceSel = card.querySelector('select[data-service-select]');
-      var configSel = card.querySelector('select[data-config-for]');
-      selectionSnapshot[serial] = {
-        service: serviceSel ? serviceSel.value : null,
-        config: configSel ? configSel.value : null
-      };
-    });
     if(!devices.length){
+      deviceCards = {};
       container.innerHTML = '<div class="card">No se detectaron agentes.</div>';
       return;
     }
-    container.innerHTML = devices.map(function(dev){
-      var overrides = selectionSnapshot[dev.serial] || {};
-      return renderDevice(dev, overrides);
-    }).join('');
+    // Only cards whose markup changed are rebuilt; the rest keep their nodes,
+    // listeners and any open dropdown.
+    var nextCards = {};
+    var ordered = devices.map(function(dev){
+      var serial = dev.serial || '';
+      var previous = deviceCards[serial];
+      var selection = previous ? readCardSelection(previous.node) : {};
+      var html = renderDevice(dev, selection);
+      if(previous && previous.html === html){
+        nextCards[serial] = previous;
+        return previous.node;
+      }
+      var holder = document.createElement('div');
+      holder.innerHTML = html;
+      var card = holder.firstElementChild;
+      bindDeviceCard(card, selection);
+      nextCards[serial] = { html: html, node: card };
+      return card;
+    });
+    deviceCards = nextCards;
 
-    toArray(container.querySelectorAll('.card[data-serial]')).forEach(function(card){
-      var serial = card.dataset.serial;
-      if(!serial) return;
-      var snapshot = selectionSnapshot[serial] || {};
+    var anchor = container.firstChild;
+    ordered.forEach(function(node){
+      if(node === anchor){
+        anchor = anchor.nextSibling;
+      } else {
+        container.insertBefore(node, anchor);
+      }
+    });
+    // Everything after the last placed card is stale: removed devices, replaced cards, the empty notice.
+    while(anchor){
+      var next = anchor.nextSibling;
+      container.removeChild(anchor);
+      anchor = next;
+    }
+  }
+
+  function bindDeviceCard(card, selection){
+    var serial = card.dataset.serial;
+    if(serial){
       var serviceSel = card.querySelector('select[data-service-select]');
       var serviceValue = serviceSel ? serviceSel.value : null;
-      updateConfigSection(card, serviceValue, { desiredConfig: snapshot.config });
-    });
+      updateConfigSection(card, serviceValue, { desiredConfig: selection.config });
+    }
 
-    toArray(container.querySelectorAll('select[data-service-select]')).forEach(function(sel){
+    toArray(card.querySelectorAll('select[data-service-select]')).forEach(function(sel){
       sel.addEventListener('change', function(){
         var service = sel.value;
         sel.dataset.selectedService = service;
@@ -376,7 +419,7 @@
       });
     });
 
-    toArray(container.querySelectorAll('button[data-power]')).forEach(function(btn){
+    toArray(card.querySelectorAll('button[data-power]')).forEach(function(btn){
       btn.addEventListener('click', function(){
         var serial = btn.dataset.serial;
         var action = btn.dataset.power;
@@ -384,7 +427,7 @@
       });
     });
 
-    toArray(container.querySelectorAll('button[data-apply-service]')).forEach(function(btn){
+    toArray(card.querySelectorAll('button[data-apply-service]')).forEach(function(btn){
       btn.addEventListener('click', function(){
         var serial = btn.dataset.applyService;
         var card = btn.closest('.card');
@@ -397,13 +440,13 @@
       });
     });
 
-    toArray(container.querySelectorAll('select[data-config-for]')).forEach(function(sel){
+    toArray(card.querySelectorAll('select[data-config-for]')).forEach(function(sel){
       sel.addEventListener('change', function(){
         sel.dataset.selectedConfig = sel.value || NO_CONFIG_OPTION;
       });
     });
 
-    toArray(container.querySelectorAll('button[data-open-editor]')).forEach(function(btn){
+    toArray(card.querySelectorAll('button[data-open-editor]')).forEach(function(btn){
       btn.addEventListener('click', function(){
         var service = btn.dataset.openEditor || '';
         if(!service || service === 'standby'){
@@ -414,7 +457,7 @@
       });
     });
 
-    toArray(container.querySelectorAll('button[data-restart-service]')).forEach(function(btn){
+    toArray(card.querySelectorAll('button[data-restart-service]')).forEach(function(btn){
       btn.addEventListener('click', function(){
         var serial = btn.dataset.restartService;
         var service = btn.dataset.service;
@@ -428,7 +471,7 @@
       });
     });
 
-    toArray(container.querySelectorAll('button[data-service-ui]')).forEach(function(btn){
+    toArray(card.querySelectorAll('button[data-service-ui]')).forEach(function(btn){
       btn.addEventListener('click', function(){
         if(btn.disabled){
           return;
@@ -1081,13 +1124,23 @@
     }
   });
 
+  // Newest device list received, ahead of renderDevices while presets load.
+  var latestDevices = [];
+  var devicesRev = null;
+
+  function showDevices(devices){
+    latestDevices = devices;
+    var services = new Set();
+    devices.forEach(function(dev){ (dev.available_services || []).forEach(function(s){ services.add(s); }); });
+    return Promise.all(Array.from(services).map(function(service){ return ensureConfigs(service); })).then(function(){
+      renderDevices(devices);
+    });
+  }
+
   function loadDevices(){
     fetchDevices().then(function(devices){
-      var services = new Set();
-      devices.forEach(function(dev){ (dev.available_services || []).forEach(function(s){ services.add(s); }); });
-      return Promise.all(Array.from(services).map(function(service){ return ensureConfigs(service); })).then(function(){
-        renderDevices(devices);
-      });
+      if(devices === latestDevices) return;
+      return showDevices(devices);
     }).catch(console.error);
   }
 
@@ -1106,13 +1159,103 @@
   }
 
   function loadClients(){
-    fetchClients().then(renderClientsView).catch(console.error);
+    fetchClients().then(function(clients){
+      if(clients === currentClients) return;
+      renderClientsView(clients);
+    }).catch(console.error);
+  }
+
+  function loadAll(){
+    loadDevices();
+    loadServiceConfigs(true);
+    loadClients();
+  }
+
+  // Polling is only the fallback while the /ws/ui push channel is down.
+  var pollTimers = [];
+  function startPolling(){
+    if(pollTimers.length) return;
+    pollTimers = [
+      setInterval(loadDevices, 4000),
+      setInterval(function(){ loadServiceConfigs(false); }, 15000),
+      setInterval(loadClients, 15000),
+    ];
+  }
+
+  function stopPolling(){
+    pollTimers.forEach(clearInterval);
+    pollTimers = [];
+  }
+
+  function applyDevicesPatch(msg){
+    if(devicesRev === null || msg.rev !== devicesRev + 1){
+      // A delta went missing; take a fresh list and continue from this revision.
+      devicesRev = msg.rev;
+      loadDevices();
+      return;
+    }
+    devicesRev = msg.rev;
+    var bySerial = {};
+    latestDevices.forEach(function(dev){ bySerial[dev.serial] = dev; });
+    (msg.upsert || []).forEach(function(dev){ bySerial[dev.serial] = dev; });
+    // The order lists every device; anything not in it has been removed.
+    var devices = (msg.order || []).map(function(serial){ return bySerial[serial]; }).filter(Boolean);
+    showDevices(devices).catch(console.error);
   }
 
-  setInterval(loadDevices, 4000);
-  setInterval(function(){ loadServiceConfigs(false); }, 15000);
-  setInterval(loadClients, 15000);
-  loadDevices();
-  loadServiceConfigs(true);
-  loadClients();
+  // Reconnects back off exponentially; a server that never accepted the upgrade
+  // (no WebSocket library installed) is given up on after a few attempts.
+  var PUSH_RETRY_MIN_MS = 5000;
+  var PUSH_RETRY_MAX_MS = 5 * 60 * 1000;
+  var PUSH_GIVE_UP_AFTER = 2;
+  var pushRetryMs = PUSH_RETRY_MIN_MS;
+  var pushFailures = 0;
+  var pushWasOpen = false;
+  function connectPush(){
+    if(!window.WebSocket){
+      startPolling();
+      return;
+    }
+    var ws = new WebSocket((location.protocol === 'https:' ? 'wss://' : 'ws://') + location.host + '/ws/ui');
+    ws.onopen = function(){
+      pushRetryMs = PUSH_RETRY_MIN_MS;
+      pushFailures = 0;
+      stopPolling();
+      // Devices arrive as a snapshot on join; the rest may have changed while disconnected.
+      if(pushWasOpen){
+        loadServiceConfigs(true);
+        loadClients();
+      }
+      pushWasOpen = true;
+    };
+    ws.onmessage = function(event){
+      var msg;
+      try { msg = JSON.parse(event.data); } catch(err){ return; }
+      if(msg.type === 'devices_update'){
+        devicesRev = msg.rev;
+        showDevices(msg.data || []).catch(console.error);
+      } else if(msg.type === 'devices_patch'){
+        applyDevicesPatch(msg);
+      } else if(msg.type === 'clients_update'){
+        renderClientsView(msg.data || []);
+      } else if(msg.type === 'services_update'){
+        loadServiceConfigs(true);
+      }
+    };
+    ws.onclose = function(){
+      devicesRev = null;
+      startPolling();
+      if(!pushWasOpen && ++pushFailures >= PUSH_GIVE_UP_AFTER) return;
+      setTimeout(connectPush, pushRetryMs);
+      pushRetryMs = Math.min(pushRetryMs * 2, PUSH_RETRY_MAX_MS);
+    };
+  }
+
+  // The page is served identically to every client; show the host it was opened on.
+  toArray(document.querySelectorAll('[data-host-label]')).forEach(function(node){
+    node.textContent = location.hostname || 'server';
+  });
+
+  loadAll();
+  connectPush();
 })();